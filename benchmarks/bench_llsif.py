@@ -0,0 +1,245 @@
+# coding=utf-8
+"""
+bench_llsif.py - Microbenchmarks for the Sopel LLSIF plugin's hot paths
+
+Times importing the plugin, query parsing, name formatting, song math,
+card/song rendering, and the full .sifcard/.sifsong command paths against
+recorded API fixtures, with a fake bot and trigger. Nothing touches the network.
+
+Usage:
+    python benchmarks/bench_llsif.py [--output results.json] [--compare old.json]
+
+Results are written as JSON (nanoseconds per operation, best of several runs),
+so two runs can be compared with --compare.
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import argparse
+import json
+import os.path
+import platform
+import subprocess
+import sys
+import timeit
+import types as pytypes
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import llsif  # noqa: E402
+
+from sopel.config import types  # noqa: E402
+
+
+REPEAT = 5
+
+
+def read_fixture(name):
+    with open(os.path.join(HERE, 'fixtures', name), encoding='utf-8') as f:
+        return f.read()
+
+
+def load_fixture(name, record):
+    return llsif._decode_page(read_fixture(name), record)['results']
+
+
+class NoNetwork(object):
+    """Stands in for the plugin's HTTP session; any request is a bug."""
+    def get(self, *args, **kwargs):
+        raise RuntimeError("Benchmarks must not touch the network.")
+
+    def close(self):
+        pass
+
+
+class FakeBot(object):
+    def __init__(self, config):
+        self.config = pytypes.SimpleNamespace(llsif=config)
+        self.memory = {}
+        self.output = []
+
+    def say(self, message, destination=None):
+        self.output.append(message)
+
+    def reply(self, message, destination=None):
+        self.output.append(message)
+
+
+class FakeTrigger(object):
+    def __init__(self, args, sender='#bench'):
+        self._args = args
+        self.sender = sender
+        self.nick = 'bencher'
+
+    def group(self, n):
+        if n == 2:
+            return self._args
+        raise IndexError(n)
+
+
+def default_config():
+    """Get the plugin's config section, with every setting at its default."""
+    section = pytypes.SimpleNamespace()
+    for name in dir(llsif.LLSIFSection):
+        attr = getattr(llsif.LLSIFSection, name)
+        if isinstance(attr, types.BaseValidated):
+            setattr(section, name, attr.default)
+    return section
+
+
+def make_bot(cards, songs, events, idols):
+    bot = FakeBot(default_config())
+    catalog = llsif.Catalog(':memory:')
+    catalog.store_cards(cards)
+    catalog.store_songs(songs)
+    catalog.store_events(events)
+    catalog.store_idols(idols)
+    catalog.set_complete('cards')
+    catalog.set_complete('songs')
+    catalog.set_complete('events')
+    catalog.set_complete('idols')
+    bot.memory['llsif_catalog'] = catalog
+    bot.memory['llsif_session'] = NoNetwork()
+    bot.memory['llsif_render_cache'] = llsif.RenderCache(
+        bot.config.llsif.render_cache_size)
+    bot.memory['llsif_cursors'] = llsif.SearchCursors(bot.config.llsif.cursor_timeout)
+    return bot
+
+
+def benchmarks(cards, songs, events, idols):
+    """Get the named callables to time."""
+    bot = make_bot(cards, songs, events, idols)
+    card, song = cards[0], songs[0]
+    card_page = read_fixture('cards.json')
+    song_page = read_fixture('songs.json')
+    channels = llsif._order_channels(
+        ['#channel{}'.format(n) for n in range(500)], ['#channel499'])
+
+    def command(func, args):
+        trigger = FakeTrigger(args)
+
+        def run():
+            func(bot, trigger)
+            del bot.output[:]
+        return run
+
+    return {
+        'decode_card_page': lambda: llsif._decode_page(card_page, llsif.Card),
+        'decode_song_page': lambda: llsif._decode_page(song_page, llsif.Song),
+        'parse_card_query': lambda: llsif.parse_card_query(
+            'birthday maki !promo cool ur year:first'),
+        'parse_song_query': lambda: llsif.parse_song_query(
+            'snow halation cool non-event'),
+        'format_idol.exact': lambda: llsif.format_idol('Nishikino Maki'),
+        'format_idol.partial': lambda: llsif.format_idol('maki'),
+        'format_idol.unknown': lambda: llsif.format_idol('Shiitake'),
+        'format_unit': lambda: llsif.format_unit('BiBi'),
+        'format_attribute': lambda: llsif.format_attribute('Cool'),
+        'bond_points': lambda: llsif._bond_points(760),
+        'song_level_info': lambda: llsif._get_song_level_info(song),
+        'format_card': lambda: llsif._format_card(card),
+        'format_song': lambda: llsif._format_song(song),
+        'render.card_cached': lambda: llsif._render(bot, card, '#bench'),
+        'render.song_cached': lambda: llsif._render(bot, song, '#bench'),
+        'sif_card.id': command(llsif.sif_card, str(card.id)),
+        'sif_card.latest': command(llsif.sif_card, None),
+        'sif_card.search': command(llsif.sif_card, 'birthday maki ur'),
+        'sif_card.batch': command(llsif.sif_card, '{}-{}'.format(
+            cards[0].id, cards[-1].id)),
+        'sif_cards.search': command(llsif.sif_cards, 'cool'),
+        'sif_card.fuzzy': command(llsif.sif_card, 'brithday mako ur'),
+        'sif_song.search': command(llsif.sif_song, 'snow halation'),
+        'sif_song.fuzzy': command(llsif.sif_song, 'snow halaton'),
+        'sif_songs.rank': command(llsif.sif_songs, 'top 5 master kizuna'),
+        'sif_songs.filter': command(llsif.sif_songs, 'cool expert notes>=500'),
+        'sif_event.date': command(llsif.sif_event, '2017-03-12'),
+        'sif_event.name': command(llsif.sif_event, 'medley festival'),
+        'event_index.running': lambda: bot.memory['llsif_catalog'].event_index().running(
+            1489300000, 1489300000),
+        'sif_idol': command(llsif.sif_idol, 'maki'),
+        'song_table.query': lambda: bot.memory['llsif_catalog'].song_table().query(
+            'master', 'kizuna', True, 5),
+        'broadcast.batch': lambda: list(llsif._batch_targets(
+            channels, llsif.RC_5X_MESSAGE, 4)),
+    }
+
+
+# Run in a fresh interpreter, with what Sopel itself has already loaded by the
+# time it imports a plugin, so only the plugin's own import cost is counted
+IMPORT_SCRIPT = """
+import sys, time
+sys.path.insert(0, {root!r})
+import sopel.config, sopel.formatting, sopel.logger, sopel.module
+started = time.perf_counter()
+import llsif
+print(time.perf_counter() - started)
+"""
+
+
+def time_import():
+    script = IMPORT_SCRIPT.format(root=os.path.dirname(HERE))
+    runs = [
+        float(subprocess.check_output([sys.executable, '-c', script]))
+        for _ in range(REPEAT)
+    ]
+    return {'ns_per_op': min(runs) * 1e9, 'loops': 1}
+
+
+def time_one(func):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=REPEAT, number=number))
+    return {'ns_per_op': best / number * 1e9, 'loops': number}
+
+
+def compare(results, baseline):
+    print('{:<24} {:>12} {:>12} {:>8}'.format('benchmark', 'old ns', 'new ns', 'ratio'))
+    for name, result in sorted(results.items()):
+        new = result['ns_per_op']
+        try:
+            old = baseline[name]['ns_per_op']
+        except KeyError:
+            print('{:<24} {:>12} {:>12.0f} {:>8}'.format(name, '-', new, '-'))
+            continue
+        print('{:<24} {:>12.0f} {:>12.0f} {:>7.2f}x'.format(name, old, new, new / old))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', help="write JSON results to this file")
+    parser.add_argument('--compare', help="JSON results from an earlier run")
+    parser.add_argument('-k', dest='only', help="only run benchmarks containing this")
+    args = parser.parse_args(argv)
+
+    cards = load_fixture('cards.json', llsif.Card)
+    songs = load_fixture('songs.json', llsif.Song)
+    events = load_fixture('events.json', llsif.Event)
+    idols = load_fixture('idols.json', llsif.IdolProfile)
+
+    results = {}
+    if not args.only or args.only in 'import':
+        results['import'] = time_import()
+    for name, func in sorted(benchmarks(cards, songs, events, idols).items()):
+        if args.only and args.only not in name:
+            continue
+        results[name] = time_one(func)
+
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+    elif not args.output:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -8,80 +8,453 @@ https://sopel.chat
 """
 from __future__ import unicode_literals, absolute_import, print_function, division
 
+import array
+import bisect
+import collections
+import concurrent.futures
 import datetime
+import functools
+import heapq
+import itertools
+import json
+import operator
+import os
+import os.path
 import random
 import re
-
-import requests
-from scheduler import Scheduler
-import scheduler.trigger as schedule_trigger
+import sqlite3
+import threading
+import time
+import urllib.parse
 
 from sopel.config import types
 from sopel.logger import get_logger
 from sopel import formatting, module
 
 
-def _send_rc_5x(bot):
-    channels = bot.config.llsif.rc_5x_channels or bot.channels.keys()
+def _send_rc_5x(bot, fire_at=None):
+    if not bot.config.llsif.rc_5x_notify:
+        # turned off since the timer was started
+        return
 
-    for channel in channels:
-        bot.say("[LLSIF] Rhythmic Carnival 5x EXP hour has started!", channel)
+    channels = _order_channels(
+        bot.config.llsif.rc_5x_channels or bot.channels.keys(),
+        bot.config.llsif.rc_5x_priority_channels or [],
+    )
+    _broadcast(bot, 'rc_5x', channels, RC_5X_MESSAGE, fire_at)
 
 
 UTC = datetime.timezone.utc
+JST = datetime.timezone(datetime.timedelta(hours=9))
 
 RC_5X_TIMES = [
     datetime.time(hour=3, tzinfo=UTC),
     datetime.time(hour=8, tzinfo=UTC),
     datetime.time(hour=12, tzinfo=UTC),
 ]
+# as datetime.weekday() numbers them: Saturday and Sunday
+RC_5X_DAYS = [5, 6]
+RC_5X_MESSAGE = "[LLSIF] Rhythmic Carnival 5x EXP hour has started!"
+
+# Longest the timer thread sleeps in one go: its waits don't count time spent
+# suspended, and the wall clock can jump (NTP steps), so it checks the clock
+# again every few hours even when nothing is due
+MAX_TIMER_SLEEP = 6 * 60 * 60
+# In the last TIMER_FINAL_STRETCH seconds before a start time, the thread
+# wakes every TIMER_RECHECK seconds instead, so a jump can't make it fire late
+TIMER_FINAL_STRETCH = 5 * 60
+TIMER_RECHECK = 60
+# How late an announcement may still go out; any later (after a suspend, say)
+# and that hour is skipped instead of announced
+RC_5X_GRACE = 10 * 60
+
+
+def _next_rc_5x(now):
+    """Get the first Rhythmic Carnival 5x EXP hour start after ``now``.
+
+    :param now: timezone-aware reference time
+    :type now: :class:`datetime.datetime`
+    :rtype: :class:`datetime.datetime`
+    """
+    now = now.astimezone(UTC)
+    for days in range(8):
+        day = now.date() + datetime.timedelta(days=days)
+        if day.weekday() not in RC_5X_DAYS:
+            continue
+        for start in sorted(RC_5X_TIMES):
+            fire_at = datetime.datetime.combine(day, start)
+            if fire_at > now:
+                return fire_at
+
+
+class WeeklyTimer(object):
+    """Run a callback at each RC 5x EXP hour start, with no idle polling.
+
+    A single thread sleeps until the next start time (at most
+    ``MAX_TIMER_SLEEP`` seconds at a time, and ``TIMER_RECHECK`` seconds in
+    the final stretch, to catch clock jumps), fires (passing the callback that
+    start time), and works out the following one from the current time. Start
+    times missed by more than ``RC_5X_GRACE`` are skipped. :meth:`cancel`
+    stops it for good.
+    """
+    def __init__(self, callback):
+        self._callback = callback
+        self._wakeup = threading.Event()
+        self._cancelled = False
+        self._thread = threading.Thread(
+            target=self._run, name='llsif-rc-timer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled = True
+        self._wakeup.set()
+
+    def _run(self):
+        fire_at = _next_rc_5x(datetime.datetime.now(UTC))
+        while not self._cancelled:
+            now = datetime.datetime.now(UTC)
+            delay = (fire_at - now).total_seconds()
+            if delay > TIMER_FINAL_STRETCH:
+                self._wakeup.wait(min(delay - TIMER_FINAL_STRETCH, MAX_TIMER_SLEEP))
+                continue
+            if delay > 0:
+                self._wakeup.wait(min(delay, TIMER_RECHECK))
+                continue
+
+            if -delay > RC_5X_GRACE:
+                LOGGER.warning(
+                    "Skipping LLSIF RC 5x announcement for %s; woke up %d minutes late.",
+                    fire_at.isoformat(), -delay // 60)
+            else:
+                try:
+                    self._callback(fire_at)
+                except Exception:
+                    LOGGER.exception("Error sending LLSIF RC 5x announcement!")
+            # from now, not from fire_at: every start time we slept through
+            # is in the past, and none of them should fire
+            fire_at = _next_rc_5x(max(now, datetime.datetime.now(UTC)))
+
+
+# Bytes of each PRIVMSG line left for targets and text, once the server has
+# added our nick!user@host prefix (worst case) and the command itself
+BROADCAST_LINE_BYTES = 512 - 2 - 100 - len('PRIVMSG  :')
+# Cap on targets per line when the server advertises TARGMAX without a limit
+BROADCAST_MAX_TARGETS = 20
+
+
+def _order_channels(channels, first):
+    """Put ``first`` channels at the front, in their own order.
+
+    Everything else keeps its original order; duplicates are dropped.
+
+    :param channels: every channel to send to
+    :param list first: channels that should hear it before the rest
+    :rtype: list
+    """
+    ordered = []
+    seen = set()
+    wanted = {str(channel).lower() for channel in channels}
+    for channel in itertools.chain(
+            (c for c in first if str(c).lower() in wanted), channels):
+        key = str(channel).lower()
+        if key not in seen:
+            seen.add(key)
+            ordered.append(str(channel))
+    return ordered
+
+
+def _privmsg_targets(bot):
+    """Get how many targets one PRIVMSG may have on the bot's server.
+
+    :rtype: int
+    """
+    try:
+        targmax = bot.isupport.TARGMAX
+    except (AttributeError, KeyError):
+        # not advertised: one target per message, as RFC 1459 servers expect
+        return 1
+    if 'PRIVMSG' not in targmax:
+        return 1
+    return min(targmax['PRIVMSG'] or BROADCAST_MAX_TARGETS, BROADCAST_MAX_TARGETS)
+
+
+def _batch_targets(channels, text, max_targets):
+    """Group channels into comma-separated PRIVMSG targets.
+
+    Each group has at most ``max_targets`` channels and, with ``text``, fits
+    in one IRC line.
+
+    :param list channels: channels, in the order they should be sent to
+    :param str text: the message
+    :param int max_targets: the server's PRIVMSG target limit
+    :return: lists of channels, one per line
+    :rtype: :term:`generator`
+    """
+    room = BROADCAST_LINE_BYTES - len(text.encode('utf-8'))
+    batch = []
+    used = 0
+    for channel in channels:
+        size = len(channel.encode('utf-8'))
+        if batch and (len(batch) >= max_targets or used + 1 + size > room):
+            yield batch
+            batch = []
+        used = size if not batch else used + 1 + size
+        batch.append(channel)
+    if batch:
+        yield batch
+
+
+def _broadcast(bot, kind, channels, text, due=None):
+    """Send ``text`` to many channels without tripping the server's flood limits.
+
+    Channels are packed into multi-target PRIVMSGs where the server's
+    ``TARGMAX`` allows it, and the lines are paced to ``broadcast_rate`` per
+    second after an initial ``broadcast_burst``. How long after ``due`` each
+    channel got the message goes to the ``broadcast_lag`` stats.
+
+    :param str kind: what is being announced, for stats and logs
+    :param list channels: channels, in the order they should be sent to
+    :param str text: the message
+    :param due: when the announcement was meant to go out (defaults to now)
+    :type due: :class:`datetime.datetime`
+    """
+    if due is None:
+        due = datetime.datetime.now(UTC)
+    pacer = RateLimiter(bot.config.llsif.broadcast_rate, bot.config.llsif.broadcast_burst)
+    stats = _stats(bot)
+
+    lines = 0
+    lag = 0.0
+    for batch in _batch_targets(channels, text, _privmsg_targets(bot)):
+        if bot.config.llsif.broadcast_rate > 0:
+            pacer.acquire(None, PRIORITY_BACKGROUND)
+        bot.write(('PRIVMSG', ','.join(batch)), text)
+        lag = (datetime.datetime.now(UTC) - due).total_seconds()
+        for _ in batch:
+            stats.observe('broadcast_lag', kind, lag)
+        lines += 1
+
+    LOGGER.info(
+        "Sent %s announcement to %d channels in %d lines; the last got it %.1fs late.",
+        kind, len(channels), lines, lag)
 
 
 class LLSIFSection(types.StaticSection):
     rc_5x_notify = types.BooleanAttribute('rc_5x_notify', default=False)
     rc_5x_channels = types.ListAttribute('rc_5x_channels')
+    # channels that hear about RC 5x before the rest, in this order
+    rc_5x_priority_channels = types.ListAttribute('rc_5x_priority_channels')
+    # announcement lines sent per second after an initial burst (0 to not
+    # pace them); the defaults match Sopel's own flood protection
+    broadcast_rate = types.ValidatedAttribute('broadcast_rate', float, default=1.0)
+    broadcast_burst = types.ValidatedAttribute('broadcast_burst', int, default=4)
+    catalog = types.BooleanAttribute('catalog', default=True)
+    catalog_file = types.FilenameAttribute('catalog_file')
+    # keep API responses on disk with their ETag/Last-Modified validators, so
+    # unchanged data can be revalidated with a cheap conditional request
+    validators = types.BooleanAttribute('validators', default=True)
+    validators_file = types.FilenameAttribute('validators_file')
+    validators_max_bytes = types.ValidatedAttribute(
+        'validators_max_bytes', int, default=64 * 1024 * 1024)
+    api_pool_size = types.ValidatedAttribute('api_pool_size', int, default=10)
+    api_retries = types.ValidatedAttribute('api_retries', int, default=2)
+    api_retry_backoff = types.ValidatedAttribute(
+        'api_retry_backoff', float, default=0.5)
+    cache_max_entries = types.ValidatedAttribute(
+        'cache_max_entries', int, default=1024)
+    cache_max_bytes = types.ValidatedAttribute(
+        'cache_max_bytes', int, default=8 * 1024 * 1024)
+    # TTLs are in seconds; 0 means cached entries never expire
+    # (cache_ttl_card also covers single songs, which are looked up by name)
+    cache_ttl_card = types.ValidatedAttribute('cache_ttl_card', int, default=0)
+    cache_ttl_latest = types.ValidatedAttribute(
+        'cache_ttl_latest', int, default=60 * 60)
+    cache_ttl_search = types.ValidatedAttribute(
+        'cache_ttl_search', int, default=24 * 60 * 60)
+    # how long past expiry an entry may still be served while it's refreshed
+    cache_stale = types.ValidatedAttribute(
+        'cache_stale', int, default=24 * 60 * 60)
+    max_batch_cards = types.ValidatedAttribute('max_batch_cards', int, default=10)
+    # .sifcards results per page, and how long .more can continue a search
+    cards_per_page = types.ValidatedAttribute('cards_per_page', int, default=5)
+    cursor_timeout = types.ValidatedAttribute(
+        'cursor_timeout', int, default=15 * 60)
+    # deal random songs from a separate deck for each channel
+    song_deck_per_channel = types.BooleanAttribute(
+        'song_deck_per_channel', default=True)
+    worker_threads = types.ValidatedAttribute('worker_threads', int, default=4)
+    # lookups allowed to wait for a free worker before we start refusing them
+    worker_queue = types.ValidatedAttribute('worker_queue', int, default=8)
+    command_deadline = types.ValidatedAttribute(
+        'command_deadline', float, default=15.0)
+    # steady API requests per second across all channels (0 for no limit),
+    # and how many may go out in a burst
+    rate_limit = types.ValidatedAttribute('rate_limit', float, default=2.0)
+    rate_burst = types.ValidatedAttribute('rate_burst', int, default=5)
+    # consecutive API failures before we stop trying for breaker_cooldown secs
+    breaker_threshold = types.ValidatedAttribute('breaker_threshold', int, default=5)
+    breaker_cooldown = types.ValidatedAttribute(
+        'breaker_cooldown', float, default=30.0)
+    # upper limits for the adaptive request timeouts
+    api_connect_timeout = types.ValidatedAttribute(
+        'api_connect_timeout', float, default=10.0)
+    api_read_timeout = types.ValidatedAttribute(
+        'api_read_timeout', float, default=4.0)
+    api_timeout_floor = types.ValidatedAttribute(
+        'api_timeout_floor', float, default=1.0)
+    # how many times the recent p99 latency to wait before giving up
+    api_timeout_multiplier = types.ValidatedAttribute(
+        'api_timeout_multiplier', float, default=3.0)
+    render_cache_size = types.ValidatedAttribute(
+        'render_cache_size', int, default=512)
+    # channels that get output without colors or other formatting
+    plain_channels = types.ListAttribute('plain_channels')
+    # Prometheus text-format stats, rewritten every minute if set
+    stats_file = types.FilenameAttribute('stats_file')
+    # prefetch the whole card/song catalog in the background, then keep it
+    # up to date by fetching only new cards every sync_interval hours
+    sync = types.BooleanAttribute('sync', default=False)
+    sync_interval = types.ValidatedAttribute('sync_interval', float, default=24.0)
+    sync_page_size = types.ValidatedAttribute('sync_page_size', int, default=100)
+    # seconds to wait between page requests, to go easy on the API
+    sync_delay = types.ValidatedAttribute('sync_delay', float, default=2.0)
+    # log progress every this many pages (0 to only log when done)
+    sync_progress_pages = types.ValidatedAttribute(
+        'sync_progress_pages', int, default=10)
 
 
 def setup(bot):
     bot.config.define_section('llsif', LLSIFSection)
 
+    if bot.config.llsif.catalog:
+        filename = bot.config.llsif.catalog_file or os.path.join(
+            bot.config.core.homedir, 'llsif.db')
+        bot.memory['llsif_catalog'] = Catalog(filename)
+
+    if bot.config.llsif.validators:
+        filename = bot.config.llsif.validators_file or os.path.join(
+            bot.config.core.homedir, 'llsif-http.db')
+        bot.memory['llsif_validators'] = ValidatorStore(
+            filename, bot.config.llsif.validators_max_bytes)
+
+    bot.memory['llsif_session'] = LazySession(bot.config.llsif)
+    bot.memory['llsif_cache'] = ResponseCache(
+        bot.config.llsif.cache_max_entries,
+        bot.config.llsif.cache_max_bytes,
+        bot.config.llsif.cache_stale,
+    )
+    bot.memory['llsif_workers'] = WorkerPool(
+        bot.config.llsif.worker_threads,
+        bot.config.llsif.worker_queue,
+    )
+    bot.memory['llsif_flights'] = SingleFlight()
+    if bot.config.llsif.rate_limit > 0:
+        bot.memory['llsif_limiter'] = RateLimiter(
+            bot.config.llsif.rate_limit,
+            bot.config.llsif.rate_burst,
+        )
+    bot.memory['llsif_stats'] = Stats()
+    if bot.config.llsif.stats_file:
+        stats_file = StatsFile(bot.memory['llsif_stats'], bot.config.llsif.stats_file)
+        stats_file.start()
+        bot.memory['llsif_stats_file'] = stats_file
+    bot.memory['llsif_breaker'] = CircuitBreaker(
+        bot.config.llsif.breaker_threshold,
+        bot.config.llsif.breaker_cooldown,
+        on_change=lambda state: _on_breaker_change(bot, state),
+    )
+    bot.memory['llsif_timeouts'] = AdaptiveTimeout(
+        bot.config.llsif.api_connect_timeout,
+        bot.config.llsif.api_read_timeout,
+        bot.config.llsif.api_timeout_floor,
+        bot.config.llsif.api_timeout_multiplier,
+    )
+    bot.memory['llsif_song_deck'] = SongDeck(
+        bot.config.llsif.song_deck_per_channel)
+    bot.memory['llsif_render_cache'] = RenderCache(
+        bot.config.llsif.render_cache_size)
+    bot.memory['llsif_cursors'] = SearchCursors(bot.config.llsif.cursor_timeout)
+
+    if bot.config.llsif.sync and 'llsif_catalog' in bot.memory:
+        sync = CatalogSync(bot, bot.memory['llsif_catalog'])
+        sync.start()
+        bot.memory['llsif_sync'] = sync
+
     if not bot.config.llsif.rc_5x_notify:
         return
 
-    schedule = Scheduler(tzinfo=UTC)
+    timer = WeeklyTimer(lambda fire_at: _send_rc_5x(bot, fire_at))
+    timer.start()
+
+    bot.memory['llsif_timer'] = timer
 
-    scheduled_jobs = [
-        schedule_trigger.Saturday(t) for t in RC_5X_TIMES
-    ]
-    scheduled_jobs += [
-        schedule_trigger.Sunday(t) for t in RC_5X_TIMES
-    ]
 
-    schedule.weekly(scheduled_jobs, _send_rc_5x, args=(bot,))
+def shutdown(bot):
+    try:
+        # stop this before anything it uses goes away
+        bot.memory['llsif_sync'].cancel()
+        del bot.memory['llsif_sync']
+    except KeyError:
+        pass
 
-    bot.memory['llsif_scheduler'] = schedule
+    bot.memory.pop('llsif_cache', None)
+    bot.memory.pop('llsif_flights', None)
+    bot.memory.pop('llsif_limiter', None)
+    bot.memory.pop('llsif_events', None)
+    bot.memory.pop('llsif_idols', None)
+    bot.memory.pop('llsif_cursors', None)
+    try:
+        bot.memory['llsif_stats_file'].cancel()
+        del bot.memory['llsif_stats_file']
+    except KeyError:
+        pass
 
+    bot.memory.pop('llsif_stats', None)
+    bot.memory.pop('llsif_breaker', None)
+    bot.memory.pop('llsif_timeouts', None)
+    bot.memory.pop('llsif_song_deck', None)
+    bot.memory.pop('llsif_render_cache', None)
 
-def shutdown(bot):
     try:
-        bot.memory['llsif_scheduler'].delete_jobs()
-        del bot.memory['llsif_scheduler']
+        bot.memory['llsif_workers'].shutdown()
+        del bot.memory['llsif_workers']
     except KeyError:
         pass
 
+    try:
+        bot.memory['llsif_session'].close()
+        del bot.memory['llsif_session']
+    except KeyError:
+        pass
 
-@module.interval(30)
-def scheduler_run(bot):
-    if 'llsif_scheduler' not in bot.memory:
-        return
+    try:
+        bot.memory['llsif_catalog'].close()
+        del bot.memory['llsif_catalog']
+    except KeyError:
+        pass
+
+    try:
+        bot.memory['llsif_validators'].close()
+        del bot.memory['llsif_validators']
+    except KeyError:
+        pass
 
-    bot.memory['llsif_scheduler'].exec_jobs()
+    try:
+        bot.memory['llsif_timer'].cancel()
+        del bot.memory['llsif_timer']
+    except KeyError:
+        pass
 
 
 API_BASE = 'https://schoolido.lu/api/'
 CARD_API = API_BASE + 'cards/'
 SONG_API = API_BASE + 'songs/'
+SONG_ONE = SONG_API + "{}/"
 CARD_ONE = CARD_API + "{}/"
+EVENT_API = API_BASE + 'events/'
+IDOL_API = API_BASE + 'idols/'
 
 LATEST_CARD_PARAMS = {
     'ordering': '-id',
@@ -93,6 +466,15 @@ COMMON_SEARCH_PARAMS = {
     'page_size': 1,
 }
 
+NON_DIGIT_PATTERN = re.compile(r'[^\d]')
+# everything up to the last slash; drops the stupid trailing directory after
+# the card ID in website URLs
+CARD_LINK_PATTERN = re.compile(r'(.+\/).+')
+# One card ID or range (e.g. "1205-1208"), and a whole multi-ID query made of
+# them; a lone ID is left to the single-card lookup
+CARD_ID_PATTERN = re.compile(r'(\d+)(?:-(\d+))?')
+CARD_IDS_PATTERN = re.compile(r'^\s*\d+(?:-\d+|(?:-\d+)?(?:\s+\d+(?:-\d+)?)+)\s*$')
+
 
 LOGGER = get_logger(__name__)
 
@@ -103,12 +485,16 @@ ATTRIBUTE_COLORS = {
     'cool': '41A2F5',
     'all': 'C956FC',
 }
-ATTRIBUTES = {
-    'smile': formatting.hex_color('Smile', ATTRIBUTE_COLORS['smile']),
-    'pure': formatting.hex_color('Pure', ATTRIBUTE_COLORS['pure']),
-    'cool': formatting.hex_color('Cool', ATTRIBUTE_COLORS['cool']),
-    'all': formatting.hex_color('Universal', ATTRIBUTE_COLORS['all'])
-}
+
+
+def _attribute_names():
+    """Build the formatted attribute names; see ``_format_indexes()``."""
+    return {
+        'smile': formatting.hex_color('Smile', ATTRIBUTE_COLORS['smile']),
+        'pure': formatting.hex_color('Pure', ATTRIBUTE_COLORS['pure']),
+        'cool': formatting.hex_color('Cool', ATTRIBUTE_COLORS['cool']),
+        'all': formatting.hex_color('Universal', ATTRIBUTE_COLORS['all'])
+    }
 
 
 IDOL_COLORS = {
@@ -155,53 +541,57 @@ IDOL_COLORS = {
     'shibuya kanon': 'FF7F27',
     'tang keke': 'A0FFF9',
 }
-IDOLS = {
-    'ayase eli': formatting.hex_color('Ayase Eli', IDOL_COLORS['ayase eli']),
-    'hoshizora rin': formatting.hex_color('Hoshizora Rin', IDOL_COLORS['hoshizora rin']),
-    'koizumi hanayo': formatting.hex_color('Koizumi Hanayo', IDOL_COLORS['koizumi hanayo']),
-    'kousaka honoka': formatting.hex_color('Kousaka Honoka', IDOL_COLORS['kousaka honoka']),
-    'minami kotori': formatting.hex_color('Minami Kotori', IDOL_COLORS['minami kotori']),
-    'nishikino maki': formatting.hex_color('Nishikino Maki', IDOL_COLORS['nishikino maki']),
-    'sonoda umi': formatting.hex_color('Sonoda Umi', IDOL_COLORS['sonoda umi']),
-    'toujou nozomi': formatting.hex_color('Toujou Nozomi', IDOL_COLORS['toujou nozomi']),
-    'yazawa nico': formatting.hex_color('Yazawa Nico', IDOL_COLORS['yazawa nico']),
-
-    'kira tsubasa': formatting.hex_color('Kira Tsubasa', IDOL_COLORS['kira tsubasa']),
-    'toudou erena': formatting.hex_color('Toudou Erena', IDOL_COLORS['toudou erena']),
-    # probably fine to have 'yuuki' as an alias for Setsuna
-    # A-RISE cards aren't very common
-    'yuuki anju': formatting.hex_color('Yuuki Anju', IDOL_COLORS['yuuki anju']),
-
-    'kunikida hanamaru': formatting.hex_color('Kunikida Hanamaru', IDOL_COLORS['kunikida hanamaru']),
-    'kurosawa dia': formatting.hex_color('Kurosawa Dia', IDOL_COLORS['kurosawa dia']),
-    'kurosawa ruby': formatting.hex_color('Kurosawa Ruby', IDOL_COLORS['kurosawa ruby']),
-    'matsuura kanan': formatting.hex_color('Matsuura Kanan', IDOL_COLORS['matsuura kanan']),
-    'ohara mari': formatting.hex_color('Ohara Mari', IDOL_COLORS['ohara mari']),
-    'sakurauchi riko': formatting.hex_color('Sakurauchi Riko', IDOL_COLORS['sakurauchi riko']),
-    'takami chika': formatting.hex_color('Takami Chika', IDOL_COLORS['takami chika']),
-    'tsushima yoshiko': formatting.hex_color(
-        'Tsushima {} Yohane'.format(formatting.strikethrough('Yoshiko')),
-        IDOL_COLORS['tsushima yoshiko']
-    ),
-    'watanabe you': formatting.hex_color('Watanabe You', IDOL_COLORS['watanabe you']),
-
-    'asaka karin': formatting.hex_color('Asaka Karin', IDOL_COLORS['asaka karin']),
-    'emma verde': formatting.hex_color('Emma Verde', IDOL_COLORS['emma verde']),
-    'konoe kanata': formatting.hex_color('Konoe Kanata', IDOL_COLORS['konoe kanata']),
-    'miyashita ai': formatting.hex_color('Miyashita Ai', IDOL_COLORS['miyashita ai']),
-    'nakasu kasumi': formatting.hex_color('Nakasu Kasumi', IDOL_COLORS['nakasu kasumi']),
-    'ousaka shizuku': formatting.hex_color('Ousaka Shizuku', IDOL_COLORS['ousaka shizuku']),
-    'mifune shioriko': formatting.hex_color('Mifune Shioriko', IDOL_COLORS['mifune shioriko']),
-    'tennoji rina': formatting.hex_color('Tennoji Rina', IDOL_COLORS['tennoji rina']),
-    'uehara ayumu': formatting.hex_color('Uehara Ayumu', IDOL_COLORS['uehara ayumu']),
-    'yuki setsuna': formatting.hex_color('Yuki Setsuna', IDOL_COLORS['yuki setsuna']),
-
-    'arashi chisato': formatting.hex_color('Arashi Chisato', IDOL_COLORS['arashi chisato']),
-    'hazuki ren': formatting.hex_color('Hazuki Ren', IDOL_COLORS['hazuki ren']),
-    'heanna sumire': formatting.hex_color('Heanna Sumire', IDOL_COLORS['heanna sumire']),
-    'shibuya kanon': formatting.hex_color('Shibuya Kanon', IDOL_COLORS['shibuya kanon']),
-    'tang keke': formatting.hex_color('Tang Keke', IDOL_COLORS['tang keke']),
-}
+
+
+def _idol_names():
+    """Build the formatted idol names; see ``_format_indexes()``."""
+    return {
+        'ayase eli': formatting.hex_color('Ayase Eli', IDOL_COLORS['ayase eli']),
+        'hoshizora rin': formatting.hex_color('Hoshizora Rin', IDOL_COLORS['hoshizora rin']),
+        'koizumi hanayo': formatting.hex_color('Koizumi Hanayo', IDOL_COLORS['koizumi hanayo']),
+        'kousaka honoka': formatting.hex_color('Kousaka Honoka', IDOL_COLORS['kousaka honoka']),
+        'minami kotori': formatting.hex_color('Minami Kotori', IDOL_COLORS['minami kotori']),
+        'nishikino maki': formatting.hex_color('Nishikino Maki', IDOL_COLORS['nishikino maki']),
+        'sonoda umi': formatting.hex_color('Sonoda Umi', IDOL_COLORS['sonoda umi']),
+        'toujou nozomi': formatting.hex_color('Toujou Nozomi', IDOL_COLORS['toujou nozomi']),
+        'yazawa nico': formatting.hex_color('Yazawa Nico', IDOL_COLORS['yazawa nico']),
+
+        'kira tsubasa': formatting.hex_color('Kira Tsubasa', IDOL_COLORS['kira tsubasa']),
+        'toudou erena': formatting.hex_color('Toudou Erena', IDOL_COLORS['toudou erena']),
+        # probably fine to have 'yuuki' as an alias for Setsuna
+        # A-RISE cards aren't very common
+        'yuuki anju': formatting.hex_color('Yuuki Anju', IDOL_COLORS['yuuki anju']),
+
+        'kunikida hanamaru': formatting.hex_color('Kunikida Hanamaru', IDOL_COLORS['kunikida hanamaru']),
+        'kurosawa dia': formatting.hex_color('Kurosawa Dia', IDOL_COLORS['kurosawa dia']),
+        'kurosawa ruby': formatting.hex_color('Kurosawa Ruby', IDOL_COLORS['kurosawa ruby']),
+        'matsuura kanan': formatting.hex_color('Matsuura Kanan', IDOL_COLORS['matsuura kanan']),
+        'ohara mari': formatting.hex_color('Ohara Mari', IDOL_COLORS['ohara mari']),
+        'sakurauchi riko': formatting.hex_color('Sakurauchi Riko', IDOL_COLORS['sakurauchi riko']),
+        'takami chika': formatting.hex_color('Takami Chika', IDOL_COLORS['takami chika']),
+        'tsushima yoshiko': formatting.hex_color(
+            'Tsushima {} Yohane'.format(formatting.strikethrough('Yoshiko')),
+            IDOL_COLORS['tsushima yoshiko']
+        ),
+        'watanabe you': formatting.hex_color('Watanabe You', IDOL_COLORS['watanabe you']),
+
+        'asaka karin': formatting.hex_color('Asaka Karin', IDOL_COLORS['asaka karin']),
+        'emma verde': formatting.hex_color('Emma Verde', IDOL_COLORS['emma verde']),
+        'konoe kanata': formatting.hex_color('Konoe Kanata', IDOL_COLORS['konoe kanata']),
+        'miyashita ai': formatting.hex_color('Miyashita Ai', IDOL_COLORS['miyashita ai']),
+        'nakasu kasumi': formatting.hex_color('Nakasu Kasumi', IDOL_COLORS['nakasu kasumi']),
+        'ousaka shizuku': formatting.hex_color('Ousaka Shizuku', IDOL_COLORS['ousaka shizuku']),
+        'mifune shioriko': formatting.hex_color('Mifune Shioriko', IDOL_COLORS['mifune shioriko']),
+        'tennoji rina': formatting.hex_color('Tennoji Rina', IDOL_COLORS['tennoji rina']),
+        'uehara ayumu': formatting.hex_color('Uehara Ayumu', IDOL_COLORS['uehara ayumu']),
+        'yuki setsuna': formatting.hex_color('Yuki Setsuna', IDOL_COLORS['yuki setsuna']),
+
+        'arashi chisato': formatting.hex_color('Arashi Chisato', IDOL_COLORS['arashi chisato']),
+        'hazuki ren': formatting.hex_color('Hazuki Ren', IDOL_COLORS['hazuki ren']),
+        'heanna sumire': formatting.hex_color('Heanna Sumire', IDOL_COLORS['heanna sumire']),
+        'shibuya kanon': formatting.hex_color('Shibuya Kanon', IDOL_COLORS['shibuya kanon']),
+        'tang keke': formatting.hex_color('Tang Keke', IDOL_COLORS['tang keke']),
+    }
 
 
 # Some of these are just for convenience, like preventing "umi" from pulling up
@@ -254,17 +644,36 @@ UNIT_COLORS = {
     'cyaron!': 'F8B646',
     'guilty kiss': 'C398FF',
 }
-UNITS = {
-    'μ\'s': formatting.hex_color('μ\'s', UNIT_COLORS['μ\'s']),
-    'bibi': formatting.hex_color('BiBi', UNIT_COLORS['bibi']),
-    'lily white': formatting.hex_color('Lily White', UNIT_COLORS['lily white']),
-    'printemps': formatting.hex_color('Printemps', UNIT_COLORS['printemps']),
-
-    'aqours': formatting.hex_color('Aqours', UNIT_COLORS['aqours']),
-    'azalea': formatting.hex_color('Azalea', UNIT_COLORS['azalea']),
-    'cyaron!': formatting.hex_color('CYaRon!', UNIT_COLORS['cyaron!']),
-    'guilty kiss': formatting.hex_color('Guilty Kiss', UNIT_COLORS['guilty kiss']),
+
+
+def _unit_names():
+    """Build the formatted unit names; see ``_format_indexes()``."""
+    return {
+        'μ\'s': formatting.hex_color('μ\'s', UNIT_COLORS['μ\'s']),
+        'bibi': formatting.hex_color('BiBi', UNIT_COLORS['bibi']),
+        'lily white': formatting.hex_color('Lily White', UNIT_COLORS['lily white']),
+        'printemps': formatting.hex_color('Printemps', UNIT_COLORS['printemps']),
+
+        'aqours': formatting.hex_color('Aqours', UNIT_COLORS['aqours']),
+        'azalea': formatting.hex_color('Azalea', UNIT_COLORS['azalea']),
+        'cyaron!': formatting.hex_color('CYaRon!', UNIT_COLORS['cyaron!']),
+        'guilty kiss': formatting.hex_color('Guilty Kiss', UNIT_COLORS['guilty kiss']),
+    }
+
+
+# Unit names as the API spells them, for use in search filters
+UNIT_NAMES = {
+    'μ\'s': 'μ\'s',
+    'bibi': 'BiBi',
+    'lily white': 'lily white',
+    'printemps': 'Printemps',
+
+    'aqours': 'Aqours',
+    'azalea': 'AZALEA',
+    'cyaron!': 'CYaRon!',
+    'guilty kiss': 'Guilty Kiss',
 }
+MAIN_UNITS = ['μ\'s', 'aqours']
 
 
 YEARS = {
@@ -283,335 +692,3066 @@ class InvalidQueryError(Exception):
 
 
 class NoResultError(Exception):
+    def __init__(self, suggestions=()):
+        super(NoResultError, self).__init__()
+        # near misses worth offering as "did you mean" alternatives
+        self.suggestions = list(suggestions)
+
+
+class BusyError(Exception):
     pass
 
 
-def _api_request(url, params={}):
-    try:
-        r = requests.get(url=url, params=params,
-                         timeout=(10.0, 4.0))
-    except requests.exceptions.ConnectTimeout:
-        raise APIError("Connection timed out.")
-    except requests.exceptions.ConnectionError:
-        raise APIError("Couldn't connect to server.")
-    except requests.exceptions.ReadTimeout:
-        raise APIError("Server took too long to send data.")
-    try:
-        r.raise_for_status()
-    except requests.exceptions.HTTPError as e:
-        if r.status_code == 404:
-            # treat 404 as if the server sent an empty result
-            return {'results': []}
-        # otherwise bubble up the error message
-        raise APIError("HTTP error: " + str(e))
-    try:
-        data = r.json()
-    except ValueError:
-        raise APIError("Couldn't decode API response: " + r.content)
+class RateLimitedError(BusyError):
+    pass
 
-    return data
 
+BUSY_MESSAGE = "Too many lookups are already waiting; please try again shortly."
 
-def _bond_points(combo):
-    """Get bond/kizuna points awarded for a given combo string."""
-    under_200 = min(200, combo)
-    over_200 = max(0, combo - 200)
-    return (
-        (combo // 10) +
-        (over_200 // 10) +
-        (4 * (combo // 50)) -
-        (over_200 // 50) +
-        (5 * (combo // 100))
-    )
 
+class _Record(object):
+    """Base for compact, typed API records.
 
-def format_attribute(attribute):
-    """Get formatted (colored, etc.) attribute string for output."""
-    attribute = attribute.lower()
-    if attribute not in ATTRIBUTES:
-        for key in ATTRIBUTES.keys():
-            if key.startswith(attribute):
-                attribute = key
-                break
+    Subclasses list the API fields they keep in ``__slots__``; everything else
+    the API sends is dropped when decoding. ``to_json()`` gives back a plain
+    dict of the kept fields (using the API's field names), which
+    ``from_json()`` also accepts.
+    """
+    __slots__ = ()
 
-    return ATTRIBUTES[attribute]
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # all field values at once, for fast comparisons
+        cls._values = operator.attrgetter(*cls.__slots__)
 
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
 
-def format_idol(idol):
-    """Get formatted (colored, etc.) idol name string for output."""
-    _idol = idol
-    idol = idol.lower()
-    if idol not in IDOLS:
-        for key in IDOLS.keys():
-            if key.startswith(idol) or key.endswith(idol):
-                idol = key
-                break
+    @classmethod
+    def from_json(cls, data):
+        return cls(**{name: data.get(name) for name in cls.__slots__})
 
-    try:
-        return IDOLS[idol]
-    except KeyError:
-        # Not one of the main girls; no color for her
-        return _idol
+    def to_json(self):
+        return {name: getattr(self, name) for name in self.__slots__}
 
+    def __eq__(self, other):
+        return type(self) is type(other) and self._values(self) == other._values(other)
 
-def format_unit(unit):
-    """Get formatted (colored, etc.) unit name string for output."""
-    if not unit:
-        # N cards, EXP/skill teachers, etc. don't have a unit name
-        return None
+    def __ne__(self, other):
+        return not self == other
 
-    _unit = unit
-    unit = unit.lower()
-    if unit not in UNITS:
-        for key in UNITS.keys():
-            if key.startswith(unit):
-                unit = key
-                break
+    def __repr__(self):
+        return '<{} {!r}>'.format(type(self).__name__, getattr(self, self.__slots__[0]))
 
-    try:
-        return UNITS[unit]
-    except KeyError:
-        # Just give back the input unformatted if it's really, truly unknown
-        return _unit
 
+def _event_name(event):
+    """Reduce an API event object to its (Japanese, canonical) name."""
+    if isinstance(event, dict):
+        return event.get('japanese_name')
+    return event
 
-def format_year(year):
-    """Get formatted school year string for output."""
-    try:
-        year = year.lower()
-    except AttributeError:
-        # Teacher cards and other specials don't have a year
-        return None
 
-    return YEARS[year]
+class Idol(_Record):
+    __slots__ = ('name', 'japanese_name', 'school', 'year', 'main_unit', 'sub_unit')
 
 
-def parse_card_query(query):
-    """Parse plain-text query into a tuple of card search parameters.
+class Card(_Record):
+    __slots__ = (
+        'id', 'idol', 'attribute', 'rarity', 'is_promo', 'is_special',
+        'japan_only', 'event', 'release_date', 'website_url',
+        'translated_collection', 'japanese_collection',
+    )
 
-    :param str query: Search query, in plain text, maybe containing keywords
-    :return: (text, attribute, rarity, want_promo, want_event)
-    :rtype: tuple
-    """
-    # Split query into words, discarding empty words
-    # (e.g. from double-spaces in the query)
-    words = filter(None, query.split(' '))
-    # Initialize state tracking
-    text = []
-    rarities = []
-    attribute = want_promo = want_event = None
+    @classmethod
+    def from_json(cls, data):
+        card = super(Card, cls).from_json(data)
+        card.idol = Idol.from_json(card.idol or {})
+        card.event = _event_name(card.event)
+        return card
 
-    for word in words:
-        # Use lowercase version with hyphens removed for comparisons
-        # Hyphen filter helps avoid duplicating too many IDOL_NICKNAMES mappings
-        # (The benefit of transforming to lowercase is obvious.)
-        _word = word.lower().replace('-', '')
-        if _word in ATTRIBUTES.keys():
-            if attribute:
-                # Can't search for multiple attributes (they're mutually exclusive)
-                raise InvalidQueryError("You cannot search for multiple attributes.")
-            attribute = _word.title()
-            continue
-        if _word in RARITIES.keys():
-            rarities.append(_word.upper())
-            continue
-        if _word == 'promo':
-            want_promo = True
-            continue
-        if _word == 'non-promo' or _word == '!promo':
-            want_promo = False
-            continue
-        if _word == 'event':
-            want_event = True
-            continue
-        if _word == 'non-event' or _word == '!event':
-            want_event = False
-            continue
-        if _word in IDOL_NICKNAMES.keys():
-            text.append(IDOL_NICKNAMES[_word])
-            continue
-        # Getting here means it's Just Another Keyword
-        text.append(word)
+    def to_json(self):
+        data = super(Card, self).to_json()
+        data['idol'] = self.idol.to_json()
+        return data
 
-    return ' '.join(text), attribute, ','.join(rarities), want_promo, want_event
+    @property
+    def is_event(self):
+        return self.event is not None
 
 
-def parse_song_query(query):
-    """Parse plain-text query into a tuple of song search parameters.
+class Song(_Record):
+    __slots__ = (
+        'name', 'romaji_name', 'translated_name', 'attribute', 'main_unit',
+        'time', 'daily_rotation', 'event',
+        'easy_difficulty', 'easy_notes',
+        'normal_difficulty', 'normal_notes',
+        'hard_difficulty', 'hard_notes',
+        'expert_difficulty', 'expert_notes',
+        'master_difficulty', 'master_notes',
+    )
 
-    :param str query: Search query, in plain text, maybe containing keywords
-    :return: (text, attribute, is_event)
-    :rtype: tuple
-    :raise InvalidQueryError: when the query contains conflicting operators
-    """
-    # Split query into words, discarding empty words
-    # (e.g. from double-spaces in the query)
-    words = filter(None, query.split(' '))
-    # Initialize state tracking
-    text = []
-    attribute = is_event = None
+    @classmethod
+    def from_json(cls, data):
+        song = super(Song, cls).from_json(data)
+        song.event = _event_name(song.event)
+        return song
 
-    for word in words:
-        _word = word.lower().replace('-', '')
-        if _word in ATTRIBUTES.keys():
-            if attribute:
-                # Can't search for multiple attributes (they're mutually exclusive)
-                raise InvalidQueryError("You cannot search for multiple attributes.")
-            attribute = _word.title()
-            continue
-        if _word == 'event':
-            is_event = True
-            continue
-        if _word == 'non-event' or _word == '!event':
-            is_event = False
-            continue
-        # Getting here means it's Just Another Keyword
-        text.append(word)
+    @property
+    def is_event(self):
+        return self.event is not None
 
-    return ' '.join(text), attribute, is_event
 
+class Event(_Record):
+    __slots__ = (
+        'japanese_name', 'romaji_name', 'english_name', 'translated_name',
+        'beginning', 'end', 'english_beginning', 'english_end',
+    )
 
-@module.commands('sifcard')
-@module.example('.sifcard')
-@module.example('.sifcard jp')
-@module.example('.sifcard 123')
-@module.example('.sifcard birthday maki ur')
-def sif_card(bot, trigger):
-    """Fetch LLSIF EN/WW card information.
+    @property
+    def name(self):
+        """The event's name in English, if it has one."""
+        return (self.english_name or self.translated_name
+                or self.romaji_name or self.japanese_name)
 
-    Search by card number/ID, or by keywords.
 
-    Special keywords: attribute (Smile/Pure/Cool/All), rarity (N/R/SR/SSR/UR), event/non-event, promo/non-promo
+class IdolProfile(_Record):
+    """An idol's details, from the idols API (unlike :class:`Idol`, from cards)."""
+    __slots__ = (
+        'name', 'japanese_name', 'school', 'year', 'main_unit', 'sub_unit',
+        'attribute', 'birthday', 'age', 'height', 'blood', 'cv',
+    )
+
+    @classmethod
+    def from_json(cls, data):
+        idol = super(IdolProfile, cls).from_json(data)
+        if isinstance(idol.cv, dict):
+            # just the voice actress's name
+            idol.cv = idol.cv.get('name')
+        return idol
+
+
+# What each API endpoint's objects decode into
+RECORD_TYPES = {
+    'cards': Card,
+    'songs': Song,
+    'events': Event,
+    'idols': IdolProfile,
+}
+
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_PAGE_NEXT_PATTERN = re.compile(r'"next"\s*:\s*(null|"(?:[^"\\]|\\.)*")')
+_PAGE_COUNT_PATTERN = re.compile(r'"count"\s*:\s*(\d+)')
+
+
+def _decode_page(text, record):
+    """Decode a page of API results into records, one result at a time.
+
+    Each result's full dict only lives long enough to be turned into a
+    record, rather than the whole page's worth being decoded up front.
+
+    :param str text: the raw response body
+    :param record: the :class:`_Record` subclass results decode into
+    :return: ``{'count': ..., 'next': ..., 'results': [...]}``, like the
+             API's own page
+    :rtype: dict
+    :raise ValueError: if the body isn't a page of results
     """
-    arg = trigger.group(2)
-    params = {}
-    url = CARD_API
-    if arg is None or arg.lower() in ['en', 'ww']:
-        params = LATEST_CARD_PARAMS
-        prefix = "Latest SIF EN/WW card: "
-    elif arg.lower() == 'jp':
-        params = LATEST_CARD_PARAMS.copy()
-        del params['japan_only']
-        prefix = "Latest SIF JP card: "
-    else:
-        prefix = ""
-        if re.search(r'[^\d]', arg):
-            # non-digits in query means run a keyword search
-            params = COMMON_SEARCH_PARAMS.copy()
-            try:
-                text, attribute, rarities, promo, event = parse_card_query(arg)
-            except InvalidQueryError as err:
-                return bot.reply("You have an error in your query: {}".format(err))
-            params.update({
-                'search': text,
-                'attribute': attribute,
-                'rarity': rarities,
-                'is_promo': promo,
-                'is_event': event,
-            })
-        else:
-            # query of only digits means run an ID number lookup
-            url = CARD_ONE.format(arg)
+    decoder = json.JSONDecoder()
+    try:
+        start = text.index('[', text.index('"results"'))
+    except ValueError:
+        raise ValueError("No results list in response.")
 
+    results = []
+    pos = _JSON_WHITESPACE.match(text, start + 1).end()
     try:
-        data = _api_request(url, params)
-    except APIError as err:
-        bot.say("Sorry, something went wrong with the card API.")
-        LOGGER.exception("LLSIF API error!")
-        return
+        while text[pos] != ']':
+            item, pos = decoder.raw_decode(text, pos)
+            results.append(record.from_json(item))
+            pos = _JSON_WHITESPACE.match(text, pos).end()
+            if text[pos] == ',':
+                pos = _JSON_WHITESPACE.match(text, pos + 1).end()
+    except IndexError:
+        raise ValueError("Truncated results list in response.")
 
-    if 'results' in data:
-        try:
-            card = data['results'][0]
-        except IndexError:
-            bot.reply("No card found!")
-            return
-    else:
-        # I'm sure this will bite me someday, but IDGAF
-        card = data
-
-    card_id = card['id']
-    character = format_idol(card['idol']['name'])
-    school = card['idol']['school']
-    attribute = format_attribute(card['attribute'])
-    rarity = card['rarity']
-    if card['is_promo']:
-        rarity = "Promo " + rarity
-    if card['is_special']:
-        rarity = "Special " + rarity
-    released = card['release_date']
-    link = card['website_url'].replace('http:', 'https:', 1)
-    # remove stupid trailing directory after card ID
-    link = re.sub(r'(.+\/).+', r'\1', link)
+    # the paging links normally come before the results, but don't rely on it
+    next_link = (_PAGE_NEXT_PATTERN.search(text, 0, start)
+                 or _PAGE_NEXT_PATTERN.search(text, pos))
+    count = (_PAGE_COUNT_PATTERN.search(text, 0, start)
+             or _PAGE_COUNT_PATTERN.search(text, pos))
+    return {
+        'count': int(count.group(1)) if count else None,
+        'next': json.loads(next_link.group(1)) if next_link else None,
+        'results': results,
+    }
 
-    idol = card['idol']
-    try:
-        types = ', '.join(filter(None, [
-            format_unit(idol['main_unit']),
-            format_year(idol['year']),
-            format_unit(idol['sub_unit']),
-        ]))
-    except KeyError:
-        types = None
 
-    collection = card.get('translated_collection', '')
-    if not collection:
-        # No localized name; use Japanese
-        collection = card.get('japanese_collection', '')
-        if not collection:
-            # No Japanese name either?! Give up, then.
-            pass
-        else:
-            # Quote name in Japanese style
-            collection = "「{}」".format(collection)
-    else:
-        # Quote name in English style
-        collection = '"{}"'.format(collection)
+def _is_last_page(data, url, page):
+    """Tell whether ``data`` is the last page of an API listing.
 
-    card_extras = ' | '.join(filter(None, [
-        types or '',
+    :raise APIError: if the page isn't a real page of results (the API answers
+                     404 for pages that don't exist, which ``_api_get()`` turns
+                     into an empty result with no count)
+    """
+    if data.get('count') is None:
+        raise APIError("Page {} of {} is missing.".format(page, url))
+    return not data.get('next')
+
+
+def _make_session(config):
+    """Create a pooled, keep-alive HTTP session for API requests.
+
+    :param config: the plugin's config section
+    :type config: :class:`LLSIFSection`
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.exceptions import ReadTimeoutError
+    from urllib3.util.retry import Retry
+
+    class NoTimeoutRetry(Retry):
+        """Retry dropped connections and 5xx answers, but never timeouts.
+
+        Retrying a timeout would run its full length again, long past the
+        command deadline (and the circuit breaker would only see one failure
+        for all of them). A keep-alive connection the server closed, though,
+        fails fast and is worth another go.
+        """
+        def increment(self, method=None, url=None, response=None, error=None,
+                      _pool=None, _stacktrace=None):
+            if isinstance(error, ReadTimeoutError):
+                # the same as with retries off: requests raises ReadTimeout
+                raise error
+            return super(NoTimeoutRetry, self).increment(
+                method, url, response, error, _pool, _stacktrace)
+
+    retry = NoTimeoutRetry(
+        total=config.api_retries,
+        # connect timeouts count as connect errors, so those aren't retried
+        connect=0,
+        backoff_factor=config.api_retry_backoff,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        # let raise_for_status() in _api_request() handle the final response
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,  # we only ever talk to one host
+        pool_maxsize=config.api_pool_size,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+    return session
+
+
+class LazySession(object):
+    """Stands in for the HTTP session until the first API request needs it.
+
+    ``requests`` is slow to import, and lookups answered from the local
+    catalog never need it, so neither is loaded until then.
+    """
+    def __init__(self, config):
+        self._config = config
+        self._session = None
+        self._lock = threading.Lock()
+
+    def get(self, *args, **kwargs):
+        session = self._session
+        if session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = _make_session(self._config)
+                session = self._session
+        return session.get(*args, **kwargs)
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+def _cache_key(url, params):
+    """Normalize a request into a hashable cache key.
+
+    ``None`` values are dropped (as ``requests`` does when building the query
+    string) and everything else is compared as text, so equivalent params
+    dicts map to the same key regardless of ordering.
+    """
+    return (url, tuple(sorted(
+        (key, str(value)) for key, value in params.items() if value is not None
+    )))
+
+
+def _cache_ttl(config, url, params):
+    """Get the cache lifetime for a request, or ``None`` if it can't be cached."""
+    if params.get('ordering') == 'random':
+        return None
+    if (url.startswith(CARD_API) and url != CARD_API) or 'ids' in params:
+        # cards by ID; these never change
+        return config.cache_ttl_card
+    if url.startswith(SONG_API) and url != SONG_API:
+        # single song by name; these don't either
+        return config.cache_ttl_card
+    if params.get('ordering') == '-id':
+        return config.cache_ttl_latest
+    return config.cache_ttl_search
+
+
+class ResponseCache(object):
+    """Bounded LRU cache of decoded API responses with per-entry TTLs.
+
+    Entries past their TTL, but still within the ``stale`` window, are served
+    as-is while the caller refreshes them in the background.
+    """
+    def __init__(self, max_entries, max_bytes, stale):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale = stale
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Look up a cached response.
+
+        :return: ``(data, needs_refresh)``, or ``(None, False)`` on a miss
+        :rtype: tuple
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                data, size, expires = self._entries[key]
+            except KeyError:
+                return None, False
+
+            if expires is not None and now > expires:
+                if now > expires + self.stale:
+                    # too old to serve normally, but kept (until evicted) as
+                    # a fallback for when the API is down; see peek()
+                    return None, False
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    self._entries.move_to_end(key)
+                    return data, True
+
+            self._entries.move_to_end(key)
+            return data, False
+
+    def put(self, key, data, size, ttl):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._refreshing.discard(key)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (data, size, expires)
+            self.size += size
+            while (len(self._entries) > self.max_entries
+                   or self.size > self.max_bytes):
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def refresh_failed(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def peek(self, key):
+        """Get a cached response however old it is, or ``None``."""
+        with self._lock:
+            entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+
+class ValidatorStore(object):
+    """On-disk store of API response bodies and their cache validators.
+
+    Responses that came with an ``ETag`` or ``Last-Modified`` header are kept
+    (across restarts, too), so the next request for the same thing can ask
+    the server whether it changed. A ``304 Not Modified`` answer is then served
+    from the stored body, instead of downloading it all again.
+
+    Once the bodies add up to more than ``max_bytes``, the least recently used
+    tenth of the entries is dropped.
+    """
+    def __init__(self, filename, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    body TEXT NOT NULL,
+                    used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+            """)
+            self.size = self._db.execute(
+                'SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get(self, key):
+        """Get the stored ``(etag, last_modified, body)`` for a request key.
+
+        :rtype: tuple or ``None``
+        """
+        key = json.dumps(key)
+        with self._lock:
+            return self._db.execute(
+                'SELECT etag, last_modified, body FROM responses WHERE key = ?',
+                (key,)).fetchone()
+
+    def touch(self, key):
+        """Mark a stored response as just used (i.e. revalidated)."""
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE responses SET used = ? WHERE key = ?',
+                (time.time(), json.dumps(key)))
+
+    def put(self, key, etag, last_modified, body):
+        key = json.dumps(key)
+        with self._lock, self._db:
+            old = self._db.execute(
+                'SELECT LENGTH(body) FROM responses WHERE key = ?', (key,)).fetchone()
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(key, etag, last_modified, body, used) VALUES (?, ?, ?, ?, ?)',
+                (key, etag, last_modified, body, time.time()))
+            self.size += len(body) - (old[0] if old else 0)
+            if self.size > self.max_bytes:
+                self._db.execute(
+                    'DELETE FROM responses WHERE key IN ('
+                    'SELECT key FROM responses ORDER BY used LIMIT '
+                    '(SELECT COUNT(*) / 10 + 1 FROM responses))')
+                self.size = self._db.execute(
+                    'SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses').fetchone()[0]
+
+
+# Upper bounds (in seconds) of the latency histogram buckets; the last bucket
+# is implicitly +Inf
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0)
+# Announcements to many channels are paced over seconds to minutes
+LAG_BUCKETS = (1.0, 2.5, 5.0, 10.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+# Seconds between rewrites of the stats_file
+STATS_FILE_INTERVAL = 60
+
+# Label names for each counter Stats keeps, in the order count() takes them
+COUNTER_LABELS = {
+    'api_errors': ('endpoint', 'type'),
+    'api_empty_404': ('endpoint',),
+    'api_not_modified': ('endpoint',),
+    'cache_requests': ('result',),
+    'lookups': ('kind', 'source'),
+    'breaker_transitions': ('state',),
+    'rate_limited': ('priority',),
+}
+COUNTER_HELP = {
+    'api_errors': "API requests that failed, by exception type or HTTP status.",
+    'api_empty_404': "API 404 responses treated as empty results.",
+    'api_not_modified': "API 304 responses served from the validator store.",
+    'cache_requests': "Response cache lookups, by result.",
+    'lookups': "Card/song lookups, by where the answer came from.",
+    'breaker_transitions': "API circuit breaker state changes, by new state.",
+    'rate_limited': "API requests turned away by the rate limiter, by priority.",
+}
+HISTOGRAM_LABELS = {
+    'command_latency': 'command',
+    'api_latency': 'endpoint',
+    'broadcast_lag': 'kind',
+}
+# Buckets for histograms that don't use LATENCY_BUCKETS
+HISTOGRAM_BUCKETS = {
+    'broadcast_lag': LAG_BUCKETS,
+}
+HISTOGRAM_HELP = {
+    'command_latency': "Time taken to handle each command.",
+    'api_latency': "Time taken by each successful API request.",
+    'broadcast_lag': "How late each channel got an announcement.",
+}
+
+
+class Histogram(object):
+    """Fixed-bucket latency histogram (Prometheus-style)."""
+    __slots__ = ('bounds', 'buckets', 'count', 'sum')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """Estimate a quantile, as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds + (float('inf'),), self.buckets):
+            seen += n
+            if seen >= target:
+                return bound
+
+
+class Stats(object):
+    """Latency histograms and event counters for the plugin."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = collections.defaultdict(dict)
+        self.counters = collections.defaultdict(collections.Counter)
+
+    def observe(self, metric, label, seconds):
+        with self._lock:
+            histogram = self.histograms[metric].get(label)
+            if histogram is None:
+                histogram = self.histograms[metric][label] = Histogram(
+                    HISTOGRAM_BUCKETS.get(metric, LATENCY_BUCKETS))
+            histogram.observe(seconds)
+
+    def count(self, metric, *labels):
+        with self._lock:
+            self.counters[metric][labels] += 1
+
+    def summary(self):
+        """Get a few human-readable lines summarizing the stats so far."""
+        lines = []
+        with self._lock:
+            for metric in sorted(self.histograms):
+                parts = []
+                for label, hist in sorted(self.histograms[metric].items()):
+                    parts.append('{} n={} p50≤{}s p95≤{}s'.format(
+                        label, hist.count, hist.quantile(0.5), hist.quantile(0.95)))
+                lines.append('{}: {}'.format(metric, '; '.join(parts)))
+            for metric in sorted(self.counters):
+                parts = [
+                    '{}={}'.format('/'.join(labels) or 'total', n)
+                    for labels, n in sorted(self.counters[metric].items())
+                ]
+                lines.append('{}: {}'.format(metric, ', '.join(parts)))
+
+            cache = self.counters.get('cache_requests', {})
+            total = sum(cache.values())
+            if total:
+                hits = cache[('hit',)] + cache[('stale',)]
+                lines.append('cache hit rate: {:.1%}'.format(hits / total))
+        return lines
+
+    def prometheus(self):
+        """Render the stats in Prometheus text exposition format."""
+        out = []
+        with self._lock:
+            for metric, hists in sorted(self.histograms.items()):
+                name = 'llsif_{}_seconds'.format(metric)
+                label = HISTOGRAM_LABELS[metric]
+                out.append('# HELP {} {}'.format(name, HISTOGRAM_HELP[metric]))
+                out.append('# TYPE {} histogram'.format(name))
+                for value, hist in sorted(hists.items()):
+                    cumulative = 0
+                    bounds = [repr(b) for b in hist.bounds] + ['+Inf']
+                    for bound, n in zip(bounds, hist.buckets):
+                        cumulative += n
+                        out.append('{}_bucket{{{}="{}",le="{}"}} {}'.format(
+                            name, label, value, bound, cumulative))
+                    out.append('{}_sum{{{}="{}"}} {}'.format(name, label, value, hist.sum))
+                    out.append('{}_count{{{}="{}"}} {}'.format(name, label, value, hist.count))
+
+            for metric, counter in sorted(self.counters.items()):
+                name = 'llsif_{}_total'.format(metric)
+                out.append('# HELP {} {}'.format(name, COUNTER_HELP[metric]))
+                out.append('# TYPE {} counter'.format(name))
+                for labels, n in sorted(counter.items()):
+                    pairs = ','.join(
+                        '{}="{}"'.format(key, value.replace('"', '\\"'))
+                        for key, value in zip(COUNTER_LABELS[metric], labels))
+                    out.append('{}{{{}}} {}'.format(name, pairs, n))
+        return '\n'.join(out) + '\n'
+
+
+class StatsFile(object):
+    """Rewrite a Prometheus text-format stats file every minute, in the background.
+
+    A write that fails is logged once, not every minute, until one succeeds
+    again. :meth:`cancel` stops it for good.
+    """
+    def __init__(self, stats, filename, interval=STATS_FILE_INTERVAL):
+        self.stats = stats
+        self.filename = filename
+        self.interval = interval
+        self._failing = False
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='llsif-stats-file', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _run(self):
+        while not self._cancelled.wait(self.interval):
+            self.write()
+
+    def write(self):
+        # write-then-rename, so scrapers never see a half-written file
+        temp = self.filename + '.tmp'
+        try:
+            with open(temp, 'w') as f:
+                f.write(self.stats.prometheus())
+            os.replace(temp, self.filename)
+        except OSError:
+            if not self._failing:
+                LOGGER.exception("Can't write LLSIF stats file %s!", self.filename)
+            self._failing = True
+            return
+        if self._failing:
+            LOGGER.info("Writing LLSIF stats file %s again.", self.filename)
+        self._failing = False
+
+
+class _NullStats(object):
+    """Stands in for :class:`Stats` when setup() hasn't made one."""
+    def observe(self, *args):
+        pass
+
+    def count(self, *args):
+        pass
+
+
+_NULL_STATS = _NullStats()
+
+
+def _stats(bot):
+    return bot.memory.get('llsif_stats') or _NULL_STATS
+
+
+def _on_breaker_change(bot, state):
+    _stats(bot).count('breaker_transitions', state)
+    if state == CircuitBreaker.OPEN:
+        LOGGER.warning("LLSIF API keeps failing; pausing requests.")
+    elif state == CircuitBreaker.CLOSED:
+        LOGGER.info("LLSIF API is responding again.")
+
+
+def _endpoint(url):
+    """Get the API endpoint name (e.g. ``'cards'``) for a URL, for stats labels."""
+    return url[len(API_BASE):].split('/', 1)[0]
+
+
+def _instrumented(command):
+    """Record how long a command handler takes in the plugin's stats."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(bot, trigger):
+            started = time.monotonic()
+            try:
+                return func(bot, trigger)
+            finally:
+                _stats(bot).observe('command_latency', command, time.monotonic() - started)
+        return wrapper
+    return decorator
+
+
+def _api_fetch(bot, url, params, channel=None, deadline=None, revalidate=True):
+    """Fetch and decode an API response.
+
+    Objects from known endpoints are decoded into records (see
+    ``RECORD_TYPES``): list endpoints give a page dict of records, and detail
+    endpoints give a single record.
+
+    Requests without a ``deadline`` are background work: they wait behind
+    everything else for the rate limiter, and neither count towards the
+    circuit breaker nor feed the adaptive timeouts, so a slow bulk sync can't
+    make interactive lookups fail. They are still refused while the circuit
+    is open.
+
+    With ``revalidate`` off, the response is neither revalidated against nor
+    kept in the validator store.
+
+    :return: ``(data, size)``, where ``size`` is the length of the raw body
+    :rtype: tuple
+    :raise RateLimitedError: if the rate limiter can't send the request in time
+    """
+    breaker = bot.memory.get('llsif_breaker')
+    # refuse before queuing for the rate limiter, so an open circuit still
+    # fails instantly and doesn't use up tokens
+    if breaker is not None and breaker.is_open():
+        _stats(bot).count('api_errors', _endpoint(url), 'CircuitOpen')
+        raise APIError("API has been failing; not trying again yet.")
+
+    limiter = bot.memory.get('llsif_limiter')
+    if limiter is not None:
+        priority = (PRIORITY_BACKGROUND if deadline is None
+                    else _api_priority(url, params))
+        try:
+            limiter.acquire(channel, priority, deadline)
+        except RateLimitedError:
+            _stats(bot).count('rate_limited', PRIORITY_NAMES[priority])
+            raise
+
+    background = deadline is None
+    if breaker is None or background:
+        return _api_get(bot, url, params, background, revalidate)
+
+    if not breaker.allow():
+        _stats(bot).count('api_errors', _endpoint(url), 'CircuitOpen')
+        raise APIError("API has been failing; not trying again yet.")
+    try:
+        result = _api_get(bot, url, params, revalidate=revalidate)
+    except Exception:
+        # anything unexpected counts too, or a failed probe would leave the
+        # breaker stuck half-open
+        breaker.failure()
+        raise
+    breaker.success()
+    return result
+
+
+def _api_get(bot, url, params, background=False, revalidate=True):
+    import requests
+
+    stats = _stats(bot)
+    endpoint = _endpoint(url)
+    # fall back to one-off connections if setup() hasn't made a session
+    http = bot.memory.get('llsif_session', requests)
+    timeouts = bot.memory.get('llsif_timeouts')
+    timeout_class = _timeout_class(params)
+
+    validators = bot.memory.get('llsif_validators') if revalidate else None
+    if params.get('ordering') == 'random':
+        # a different answer every time; nothing to revalidate
+        validators = None
+    key = _cache_key(url, params)
+    stored = validators.get(key) if validators else None
+    headers = {}
+    if stored:
+        etag, last_modified, _ = stored
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+    started = time.monotonic()
+    try:
+        if background or not timeouts:
+            timeout = (bot.config.llsif.api_connect_timeout,
+                       bot.config.llsif.api_read_timeout)
+        else:
+            timeout = timeouts.current(timeout_class)
+        r = http.get(url=url, params=params, headers=headers, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        stats.count('api_errors', endpoint, type(e).__name__)
+        if isinstance(e, requests.exceptions.ConnectTimeout):
+            raise APIError("Connection timed out.")
+        if isinstance(e, requests.exceptions.RetryError):
+            raise APIError("Server kept returning errors.")
+        if isinstance(e, requests.exceptions.ConnectionError):
+            raise APIError("Couldn't connect to server.")
+        if isinstance(e, requests.exceptions.ReadTimeout):
+            raise APIError("Server took too long to send data.")
+        raise
+    elapsed = time.monotonic() - started
+    stats.observe('api_latency', endpoint, elapsed)
+    if timeouts and not background:
+        timeouts.record(timeout_class, elapsed)
+    if r.status_code == 304 and stored:
+        stats.count('api_not_modified', endpoint)
+        validators.touch(key)
+        text = stored[2]
+    else:
+        try:
+            r.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            if r.status_code == 404:
+                # treat 404 as if the server sent an empty result
+                stats.count('api_empty_404', endpoint)
+                return {'results': []}, 0
+            # otherwise bubble up the error message
+            stats.count('api_errors', endpoint, 'HTTP {}'.format(r.status_code))
+            raise APIError("HTTP error: " + str(e))
+        text = r.text
+
+    record = RECORD_TYPES.get(endpoint)
+    try:
+        if record is None:
+            data = json.loads(text)
+        elif url == API_BASE + endpoint + '/':
+            data = _decode_page(text, record)
+        else:
+            data = record.from_json(json.loads(text))
+    except ValueError:
+        stats.count('api_errors', endpoint, 'ValueError')
+        raise APIError("Couldn't decode API response: " + text[:200])
+
+    if validators and r.status_code == 200 and (
+            r.headers.get('ETag') or r.headers.get('Last-Modified')):
+        # only stored once it's known to decode
+        validators.put(
+            key, r.headers.get('ETag'), r.headers.get('Last-Modified'), text)
+
+    return data, len(text)
+
+
+def _api_refresh(bot, cache, key, url, params, ttl):
+    try:
+        data, size = _api_fetch(bot, url, params)
+    except Exception:
+        # whatever went wrong, the next stale hit must be free to try again
+        LOGGER.exception("LLSIF API error while refreshing cache!")
+        cache.refresh_failed(key)
+        return
+    cache.put(key, data, size, ttl)
+
+
+def _api_request(bot, url, params={}, channel=None, deadline=None):
+    cache = bot.memory.get('llsif_cache')
+    ttl = _cache_ttl(bot.config.llsif, url, params)
+    if cache is None or ttl is None:
+        return _api_fetch(bot, url, params, channel, deadline)[0]
+
+    key = _cache_key(url, params)
+    data, needs_refresh = cache.get(key)
+    _stats(bot).count('cache_requests', (
+        'miss' if data is None else 'stale' if needs_refresh else 'hit'))
+    if needs_refresh:
+        threading.Thread(
+            target=_api_refresh,
+            args=(bot, cache, key, url, params, ttl),
+            name='llsif-cache-refresh',
+            daemon=True,
+        ).start()
+    if data is not None:
+        return data
+
+    try:
+        data, size = _api_fetch(bot, url, params, channel, deadline)
+    except APIError:
+        # an old answer beats no answer while the API is having trouble
+        data = cache.peek(key)
+        if data is None:
+            raise
+        _stats(bot).count('cache_requests', 'fallback')
+        LOGGER.warning("LLSIF API error; serving expired cache entry for %s", url)
+        return data
+    cache.put(key, data, size, ttl)
+    return data
+
+
+class CircuitBreaker(object):
+    """Stop calling the API for a while after it fails repeatedly.
+
+    After ``threshold`` consecutive failures the circuit opens, and requests
+    fail instantly for ``cooldown`` seconds. Then it half-opens: one probe
+    request is let through, closing the circuit if it succeeds or reopening
+    it if it fails.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold, cooldown, on_change=None):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self._on_change = on_change
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            if self._on_change:
+                self._on_change(state)
+
+    def is_open(self):
+        """Check whether requests are being refused, without claiming the probe."""
+        with self._lock:
+            return (self.state == self.OPEN
+                    and time.monotonic() - self._opened_at < self.cooldown)
+
+    def allow(self):
+        """Check whether a request may go ahead right now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN
+                    and time.monotonic() - self._opened_at >= self.cooldown):
+                # this caller gets to be the probe
+                self._set_state(self.HALF_OPEN)
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._set_state(self.CLOSED)
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+def _timeout_class(params):
+    """Classify an API request by how long it should take (see ``AdaptiveTimeout``)."""
+    try:
+        page_size = int(params.get('page_size', 1))
+    except (TypeError, ValueError):
+        page_size = 1
+    return 'page' if page_size > 1 or 'ids' in params else 'single'
+
+
+class AdaptiveTimeout(object):
+    """Derive request timeouts from recently observed API latency.
+
+    Timeouts are a multiple of the recent 99th-percentile latency of the same
+    class of request (see ``_timeout_class()``), kept between ``floor`` and
+    the configured connect/read maximums. Until enough requests of a class
+    have been seen, the maximums are used as-is.
+    """
+    MIN_SAMPLES = 20
+
+    def __init__(self, connect_max, read_max, floor, multiplier, samples=200):
+        self.connect_max = connect_max
+        self.read_max = read_max
+        self.floor = floor
+        self.multiplier = multiplier
+        self._samples = collections.defaultdict(
+            lambda: collections.deque(maxlen=samples))
+        self._lock = threading.Lock()
+
+    def record(self, kind, seconds):
+        with self._lock:
+            self._samples[kind].append(seconds)
+
+    def current(self, kind):
+        """Get the ``(connect, read)`` timeout to use for the next ``kind`` request."""
+        with self._lock:
+            if len(self._samples.get(kind, ())) < self.MIN_SAMPLES:
+                return self.connect_max, self.read_max
+            samples = sorted(self._samples[kind])
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        timeout = max(self.floor, p99 * self.multiplier)
+        return min(self.connect_max, timeout), min(self.read_max, timeout)
+
+
+class WorkerPool(object):
+    """Bounded thread pool for API work, with a limit on queued jobs.
+
+    Once ``threads + queue`` jobs are running or waiting, further submissions
+    are refused with :class:`BusyError` instead of piling up.
+    """
+    def __init__(self, threads, queue):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='llsif-worker')
+        self._slots = threading.BoundedSemaphore(threads + queue)
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise BusyError
+        try:
+            future = self._executor.submit(fn, *args)
+        except RuntimeError:
+            # executor is shutting down
+            self._slots.release()
+            raise BusyError
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class SingleFlight(object):
+    """Coalesce concurrent identical requests into one.
+
+    Callers asking for a key that's already in flight get the same future
+    (and so the same result, or the same exception) as the first caller.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, start):
+        """Get the in-flight future for ``key``, calling ``start()`` if there is none.
+
+        :param key: hashable request identity (see ``_cache_key()``)
+        :param start: callable that begins the request and returns its future
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future
+            future = self._calls[key] = start()
+
+        # outside the lock: the callback runs right away if already done
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+
+# Rate limiter priorities, most urgent first
+PRIORITY_LOOKUP = 0      # single cards/songs by ID or name; cheap for the API
+PRIORITY_SEARCH = 1      # keyword searches and listings
+PRIORITY_BACKGROUND = 2  # cache refreshes and catalog sync; nobody is waiting
+PRIORITY_NAMES = ('lookup', 'search', 'background')
+
+
+def _api_priority(url, params):
+    """Classify an API request for the rate limiter."""
+    if (url != CARD_API and url.startswith(CARD_API)) or 'ids' in params:
+        return PRIORITY_LOOKUP
+    if url != SONG_API and url.startswith(SONG_API):
+        return PRIORITY_LOOKUP
+    return PRIORITY_SEARCH
+
+
+class RateLimiter(object):
+    """Token bucket shared by every API request, with fair queuing.
+
+    Tokens refill at ``rate`` per second, up to ``burst``. When none are
+    left, requests queue up by priority; within a priority, channels take
+    turns, so one busy channel can't starve the others.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._cond = threading.Condition()
+        # per priority: channel -> waiting tickets, in turn order
+        self._queues = [collections.OrderedDict() for _ in PRIORITY_NAMES]
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def _waiting(self, priority):
+        return sum(
+            len(tickets)
+            for queue in self._queues[:priority + 1]
+            for tickets in queue.values())
+
+    def _head(self):
+        for queue in self._queues:
+            for tickets in queue.values():
+                return tickets[0]
+        return None
+
+    def _dequeue(self, priority, channel, ticket):
+        queue = self._queues[priority]
+        tickets = queue[channel]
+        served = tickets[0] is ticket
+        tickets.remove(ticket)
+        if not tickets:
+            del queue[channel]
+        elif served:
+            # this channel had its turn; the next one goes to someone else
+            queue.move_to_end(channel)
+
+    def acquire(self, channel, priority, deadline=None):
+        """Wait for a token.
+
+        :param str channel: who the request is for (``None`` for the bot itself)
+        :param int priority: one of the ``PRIORITY_*`` constants
+        :param float deadline: :func:`time.monotonic` time by which the
+                               request must be sent, or ``None`` to wait as
+                               long as it takes
+        :raise RateLimitedError: if the token wouldn't arrive by ``deadline``
+        """
+        with self._cond:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1 and self._head() is None:
+                self._tokens -= 1
+                return
+
+            # everyone already queued at this priority or above goes first
+            eta = now + (self._waiting(priority) + 1 - self._tokens) / self.rate
+            if deadline is not None and eta > deadline:
+                raise RateLimitedError
+
+            ticket = object()
+            self._queues[priority].setdefault(channel, collections.deque()).append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    if self._tokens >= 1 and self._head() is ticket:
+                        self._tokens -= 1
+                        return
+                    if deadline is not None and now >= deadline:
+                        raise RateLimitedError
+                    timeout = (1 - self._tokens) / self.rate if self._tokens < 1 else None
+                    if deadline is not None:
+                        timeout = min(timeout or deadline - now, deadline - now)
+                    self._cond.wait(timeout)
+            finally:
+                self._dequeue(priority, channel, ticket)
+                self._cond.notify_all()
+
+
+def _api_call(bot, url, params={}, channel=None):
+    """Run an API request on the worker pool, waiting up to the command deadline.
+
+    Identical requests already in flight are joined rather than repeated.
+
+    :param str channel: where the lookup came from, for fair rate limiting
+    :raise BusyError: if the worker pool's queue is full, or the rate limiter
+                      can't fit the request in before the deadline
+    :raise APIError: if the request fails or misses the deadline
+    """
+    future = _api_start(bot, url, params, channel)
+    if future is None:
+        deadline = time.monotonic() + bot.config.llsif.command_deadline
+        return _api_request(bot, url, params, channel, deadline)
+    try:
+        return future.result(timeout=bot.config.llsif.command_deadline)
+    except concurrent.futures.TimeoutError:
+        # the request keeps going, and will still fill the cache if it succeeds
+        raise APIError("Lookup missed its deadline.")
+
+
+def _api_start(bot, url, params, channel=None):
+    """Start an API request on the worker pool, without waiting for it.
+
+    :return: the request's future, or ``None`` if there's no worker pool
+    :raise BusyError: if the worker pool's queue is full
+    """
+    deadline = time.monotonic() + bot.config.llsif.command_deadline
+    workers = bot.memory.get('llsif_workers')
+    if workers is None:
+        return None
+
+    def start():
+        return workers.submit(_api_request, bot, url, params, channel, deadline)
+
+    flights = bot.memory.get('llsif_flights')
+    if flights is None or params.get('ordering') == 'random':
+        # random picks must stay independent of each other
+        return start()
+    return flights.do(_cache_key(url, params), start)
+
+
+def _fts_query(text):
+    """Turn free search text into an FTS5 query matching all words by prefix."""
+    words = [w.replace('"', '""') for w in text.lower().split()]
+    return ' '.join('"{}"*'.format(w) for w in words if w)
+
+
+def _optional_bool(value):
+    if value is None:
+        return None
+    return int(bool(value))
+
+
+# Similarity (0-1) a fuzzy match needs to be used in place of the query, and
+# to be offered as a "did you mean" suggestion
+FUZZY_MATCH_SCORE = 0.5
+FUZZY_SUGGEST_SCORE = 0.3
+
+
+def _trigrams(text):
+    padded = '  {} '.format(' '.join(text.lower().split()))
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class TrigramIndex(object):
+    """Typo-tolerant lookup of short strings by trigram similarity.
+
+    Each string is broken into overlapping three-character chunks; candidates
+    sharing any chunk with the query are ranked by the Dice coefficient of
+    their chunk sets.
+    """
+    def __init__(self):
+        self._entries = []
+        self._postings = collections.defaultdict(list)
+        self._texts = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, text):
+        return text.lower() in self._texts
+
+    def add(self, text, value):
+        self._texts.add(text.lower())
+        grams = _trigrams(text)
+        entry = len(self._entries)
+        self._entries.append((len(grams), value))
+        for gram in grams:
+            self._postings[gram].append(entry)
+
+    def search(self, text, limit=3):
+        """Find the values whose strings best match ``text``.
+
+        :return: up to ``limit`` ``(score, value)`` pairs, best first, with
+                 each value appearing at most once
+        :rtype: list
+        """
+        grams = _trigrams(text)
+        shared = collections.Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+
+        best = {}
+        for entry, common in shared.items():
+            size, value = self._entries[entry]
+            score = 2.0 * common / (size + len(grams))
+            if score > best.get(value, 0):
+                best[value] = score
+        ranked = sorted(best.items(), key=lambda item: (-item[1], item[0]))
+        return [(score, value) for value, score in ranked[:limit]]
+
+
+# SQL conditions for the extra filters parse_card_query()/parse_song_query()
+# can produce
+CARD_FILTER_SQL = {
+    'name': "json_extract(data, '$.idol.name') = ? COLLATE NOCASE",
+    'idol_year': "json_extract(data, '$.idol.year') = ?",
+    'idol_main_unit': "json_extract(data, '$.idol.main_unit') = ? COLLATE NOCASE",
+    'idol_sub_unit': "json_extract(data, '$.idol.sub_unit') = ? COLLATE NOCASE",
+    'id__gt': 'id > ?',
+    'id__gte': 'id >= ?',
+    'id__lt': 'id < ?',
+    'id__lte': 'id <= ?',
+}
+SONG_FILTER_SQL = {
+    'main_unit': "json_extract(data, '$.main_unit') = ? COLLATE NOCASE",
+}
+
+
+class Catalog(object):
+    """Local SQLite store of card and song data.
+
+    The SIF catalog stopped changing when the game shut down, so anything the
+    API has ever told us stays valid. Cards and songs are kept as their raw
+    API JSON, with the fields used by searches pulled out into indexed columns
+    and (when SQLite supports it) an FTS5 index for keyword search.
+
+    "Latest", random picks and keyword searches are only answered locally
+    once a kind has been marked complete, since a partial catalog can't know
+    what it's missing.
+    """
+    def __init__(self, filename):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(filename, check_same_thread=False)
+        self._fts = self._has_fts5()
+        # per kind of record, bumped whenever stored rows actually change, so
+        # derived indexes know when to rebuild
+        self.versions = collections.Counter()
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+        with self._lock, self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS cards (
+                    id INTEGER PRIMARY KEY,
+                    attribute TEXT,
+                    rarity TEXT,
+                    is_promo INTEGER,
+                    is_event INTEGER,
+                    japan_only INTEGER,
+                    search_text TEXT,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS cards_filters
+                    ON cards (attribute, rarity, is_promo, is_event);
+                CREATE INDEX IF NOT EXISTS cards_event
+                    ON cards (json_extract(data, '$.event'));
+                CREATE INDEX IF NOT EXISTS cards_idol
+                    ON cards (json_extract(data, '$.idol.name') COLLATE NOCASE);
+                CREATE TABLE IF NOT EXISTS songs (
+                    name TEXT NOT NULL UNIQUE,
+                    attribute TEXT,
+                    is_event INTEGER,
+                    search_text TEXT,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS events (
+                    name TEXT PRIMARY KEY,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS idols (
+                    name TEXT PRIMARY KEY,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+            if self._fts:
+                self._db.executescript("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS cards_fts
+                        USING fts5(search_text);
+                    CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts
+                        USING fts5(search_text);
+                """)
+
+    def _has_fts5(self):
+        try:
+            self._db.execute('CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)')
+            self._db.execute('DROP TABLE temp.fts5_probe')
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _fetch_one(self, record, sql, args):
+        with self._lock:
+            row = self._db.execute(sql, args).fetchone()
+        if row is None:
+            return None
+        return record.from_json(json.loads(row[0]))
+
+    def _text_filter(self, table, text, where, args):
+        if not text:
+            return
+        if self._fts:
+            where.append(
+                'rowid IN (SELECT rowid FROM {}_fts WHERE {}_fts MATCH ?)'
+                .format(table, table))
+            args.append(_fts_query(text))
+        else:
+            for word in text.lower().split():
+                where.append('search_text LIKE ?')
+                args.append('%{}%'.format(word))
+
+    def _extra_filters(self, columns, filters, where, args):
+        for key, value in (filters or {}).items():
+            where.append(columns[key])
+            args.append(value)
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                (key, value))
+
+    def is_complete(self, kind):
+        return self.get_meta(kind + '_complete') == '1'
+
+    def set_complete(self, kind, complete=True):
+        self.set_meta(kind + '_complete', '1' if complete else '0')
+
+    def count(self, kind):
+        """Count the records of one kind (``'cards'``, ``'songs'``, etc.) stored."""
+        if kind not in RECORD_TYPES:
+            raise ValueError("Unknown record kind: {}".format(kind))
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM {}'.format(kind)).fetchone()[0]
+
+    def max_card_id(self):
+        with self._lock:
+            return self._db.execute('SELECT MAX(id) FROM cards').fetchone()[0]
+
+    def store_cards(self, cards):
+        """Insert or update :class:`Card` records."""
+        with self._lock, self._db:
+            for card in cards:
+                data = json.dumps(card.to_json())
+                if self._unchanged('cards', 'id', card.id, data):
+                    continue
+                self.versions['cards'] += 1
+                search_text = ' '.join(filter(None, [
+                    card.idol.name,
+                    card.idol.japanese_name,
+                    card.translated_collection,
+                    card.japanese_collection,
+                ])).lower()
+                self._db.execute(
+                    'INSERT OR REPLACE INTO cards '
+                    '(id, attribute, rarity, is_promo, is_event, japan_only, '
+                    'search_text, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (
+                        card.id,
+                        card.attribute,
+                        card.rarity,
+                        int(bool(card.is_promo)),
+                        int(card.is_event),
+                        int(bool(card.japan_only)),
+                        search_text,
+                        data,
+                    ))
+                if self._fts:
+                    self._db.execute(
+                        'DELETE FROM cards_fts WHERE rowid = ?', (card.id,))
+                    self._db.execute(
+                        'INSERT INTO cards_fts (rowid, search_text) VALUES (?, ?)',
+                        (card.id, search_text))
+
+    def store_songs(self, songs):
+        """Insert or update :class:`Song` records."""
+        with self._lock, self._db:
+            for song in songs:
+                data = json.dumps(song.to_json())
+                if self._unchanged('songs', 'name', song.name, data):
+                    continue
+                self.versions['songs'] += 1
+                search_text = ' '.join(filter(None, [
+                    song.name,
+                    song.romaji_name,
+                    song.translated_name,
+                ])).lower()
+                self._db.execute(
+                    'INSERT INTO songs (name, attribute, is_event, search_text, data) '
+                    'VALUES (?, ?, ?, ?, ?) ON CONFLICT (name) DO UPDATE SET '
+                    'attribute = excluded.attribute, is_event = excluded.is_event, '
+                    'search_text = excluded.search_text, data = excluded.data',
+                    (
+                        song.name,
+                        song.attribute,
+                        int(song.is_event),
+                        search_text,
+                        data,
+                    ))
+                if self._fts:
+                    rowid = self._db.execute(
+                        'SELECT rowid FROM songs WHERE name = ?',
+                        (song.name,)).fetchone()[0]
+                    self._db.execute(
+                        'DELETE FROM songs_fts WHERE rowid = ?', (rowid,))
+                    self._db.execute(
+                        'INSERT INTO songs_fts (rowid, search_text) VALUES (?, ?)',
+                        (rowid, search_text))
+
+    def _unchanged(self, table, key_column, key, data):
+        """Tell whether a record is already stored as ``data``; call with the lock held."""
+        row = self._db.execute(
+            'SELECT data FROM {} WHERE {} = ?'.format(table, key_column), (key,)).fetchone()
+        return row is not None and row[0] == data
+
+    def _derived_index(self, kind, build, name=None):
+        """Get a structure built from ``kind`` records, rebuilt only when they change.
+
+        :param str kind: the kind of record it's built from
+        :param build: callable that builds it
+        :param str name: its name, if one kind has several structures
+        """
+        name = name or kind
+        with self._derived_lock:
+            version, index = self._derived.get(name, (None, None))
+            if version != self.versions[kind]:
+                version = self.versions[kind]
+                index = build()
+                self._derived[name] = (version, index)
+            return index
+
+    def song_index(self):
+        """Get a :class:`TrigramIndex` of song titles (in every language) to names."""
+        def build():
+            index = TrigramIndex()
+            with self._lock:
+                rows = self._db.execute('SELECT name, data FROM songs').fetchall()
+            for name, data in rows:
+                song = json.loads(data)
+                for title in (name, song.get('romaji_name'), song.get('translated_name')):
+                    if title:
+                        index.add(title, name)
+            return index
+        return self._derived_index('songs', build)
+
+    def card_word_index(self):
+        """Get a :class:`TrigramIndex` of the words in idol names and collections."""
+        def build():
+            index = TrigramIndex()
+            with self._lock:
+                rows = self._db.execute('SELECT search_text FROM cards').fetchall()
+            for word in set(word for row in rows for word in row[0].split()):
+                index.add(word, word)
+            return index
+        return self._derived_index('cards', build)
+
+    def get_song(self, name):
+        return self._fetch_one(Song, 'SELECT data FROM songs WHERE name = ?', (name,))
+
+    def song_names(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT name FROM songs')]
+
+    def store_events(self, events):
+        """Insert or update :class:`Event` records."""
+        with self._lock, self._db:
+            rows = [(event.japanese_name, json.dumps(event.to_json())) for event in events]
+            rows = [row for row in rows if not self._unchanged('events', 'name', *row)]
+            if rows:
+                self.versions['events'] += 1
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO events (name, data) VALUES (?, ?)', rows)
+
+    def event_index(self):
+        """Get an :class:`EventIndex` of every event in the catalog."""
+        def build():
+            with self._lock:
+                rows = self._db.execute('SELECT data FROM events').fetchall()
+            return EventIndex(Event.from_json(json.loads(row[0])) for row in rows)
+        return self._derived_index('events', build)
+
+    def event_card_ids(self, name):
+        """Get the IDs of an event's cards, or ``None`` if the catalog is partial.
+
+        :param str name: the event's Japanese name
+        :rtype: list
+        """
+        if not self.is_complete('cards'):
+            return None
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT id FROM cards WHERE json_extract(data, '$.event') = ? "
+                "ORDER BY id", (name,))]
+
+    def store_idols(self, idols):
+        """Insert or update :class:`IdolProfile` records."""
+        with self._lock, self._db:
+            rows = [(idol.name, json.dumps(idol.to_json())) for idol in idols]
+            rows = [row for row in rows if not self._unchanged('idols', 'name', *row)]
+            if rows:
+                self.versions['idols'] += 1
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO idols (name, data) VALUES (?, ?)', rows)
+
+    def idol_index(self):
+        """Get an :class:`IdolIndex` of every idol in the catalog."""
+        def build():
+            with self._lock:
+                rows = self._db.execute('SELECT data FROM idols').fetchall()
+            return IdolIndex(IdolProfile.from_json(json.loads(row[0])) for row in rows)
+        return self._derived_index('idols', build)
+
+    def idol_card_counts(self, name):
+        """Count an idol's cards by rarity, or ``None`` if the catalog is partial.
+
+        :rtype: dict
+        """
+        if not self.is_complete('cards'):
+            return None
+        with self._lock:
+            return dict(self._db.execute(
+                "SELECT rarity, COUNT(*) FROM cards "
+                "WHERE json_extract(data, '$.idol.name') = ? COLLATE NOCASE "
+                "GROUP BY rarity", (name,)))
+
+    def song_table(self):
+        """Get a :class:`SongTable` of every song in the catalog."""
+        def build():
+            with self._lock:
+                rows = self._db.execute('SELECT data FROM songs ORDER BY name').fetchall()
+            return SongTable(Song.from_json(json.loads(row[0])) for row in rows)
+        return self._derived_index('songs', build, 'song_table')
+
+    def get_card(self, card_id):
+        return self._fetch_one(Card, 'SELECT data FROM cards WHERE id = ?', (card_id,))
+
+    def latest_card(self, japan_only=True):
+        """Get the newest card, or ``None`` if the catalog might be missing it.
+
+        :param bool japan_only: whether JP-exclusive cards are eligible
+        """
+        if not self.is_complete('cards'):
+            return None
+        sql = 'SELECT data FROM cards {}ORDER BY id DESC LIMIT 1'.format(
+            '' if japan_only else 'WHERE japan_only = 0 ')
+        return self._fetch_one(Card, sql, ())
+
+    def _card_conditions(self, text, attribute, rarity, is_promo, is_event, filters):
+        where, args = [], []
+        self._extra_filters(CARD_FILTER_SQL, filters, where, args)
+        self._text_filter('cards', text, where, args)
+        if attribute:
+            where.append('attribute = ?')
+            args.append(attribute)
+        if rarity:
+            rarities = rarity.split(',')
+            where.append('rarity IN ({})'.format(', '.join('?' * len(rarities))))
+            args.extend(rarities)
+        for column, value in (('is_promo', is_promo), ('is_event', is_event)):
+            if value is not None:
+                where.append('{} = ?'.format(column))
+                args.append(_optional_bool(value))
+        return 'WHERE {} '.format(' AND '.join(where)) if where else '', args
+
+    def search_cards(self, text='', attribute=None, rarity='', is_promo=None,
+                     is_event=None, filters=None):
+        """Find the first card matching the output of ``parse_card_query()``."""
+        where, args = self._card_conditions(
+            text, attribute, rarity, is_promo, is_event, filters)
+        sql = 'SELECT data FROM cards {}ORDER BY id LIMIT 1'.format(where)
+        return self._fetch_one(Card, sql, args)
+
+    def search_card_page(self, query, offset, limit):
+        """Get one page of the cards matching the output of ``parse_card_query()``.
+
+        :param tuple query: ``parse_card_query()``'s output
+        :return: ``(total, cards)``, where ``total`` counts every match
+        :rtype: tuple
+        """
+        where, args = self._card_conditions(*query)
+        with self._lock:
+            total = self._db.execute(
+                'SELECT COUNT(*) FROM cards {}'.format(where), args).fetchone()[0]
+            rows = self._db.execute(
+                'SELECT data FROM cards {}ORDER BY id LIMIT ? OFFSET ?'.format(where),
+                args + [limit, offset]).fetchall()
+        return total, [Card.from_json(json.loads(row[0])) for row in rows]
+
+    def search_songs(self, text='', attribute=None, is_event=None, filters=None,
+                     name=None):
+        """Find the first song matching the output of ``parse_song_query()``.
+
+        Queries without any text (or exact ``name``) pick a random song, but
+        only from a complete catalog.
+        """
+        where, args = [], []
+        self._extra_filters(SONG_FILTER_SQL, filters, where, args)
+        self._text_filter('songs', text, where, args)
+        if name:
+            where.append('name = ?')
+            args.append(name)
+        if attribute:
+            where.append('attribute = ?')
+            args.append(attribute)
+        if is_event is not None:
+            where.append('is_event = ?')
+            args.append(_optional_bool(is_event))
+
+        if text or name:
+            order = 'rowid'
+        elif self.is_complete('songs'):
+            order = 'RANDOM()'
+        else:
+            return None
+
+        sql = 'SELECT data FROM songs {}ORDER BY {} LIMIT 1'.format(
+            'WHERE {} '.format(' AND '.join(where)) if where else '', order)
+        return self._fetch_one(Song, sql, args)
+
+
+LEVELS = ('easy', 'normal', 'hard', 'expert', 'master')
+SONG_METRICS = ('stars', 'notes', 'kizuna')
+COMPARISONS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    ':': operator.eq,
+    '=': operator.eq,
+}
+
+
+class SongTable(object):
+    """Column-oriented copy of the song catalog, for ranking songs by the numbers.
+
+    Stars, note counts, and kizuna for each difficulty are kept in parallel
+    integer arrays (one slot per song; 0 where a song lacks that difficulty),
+    so a query is a few tight passes over plain numbers instead of a walk
+    through every :class:`Song`.
+    """
+    def __init__(self, songs):
+        self.songs = list(songs)
+        self.attributes = [song.attribute for song in self.songs]
+        self.main_units = [(song.main_unit or '').lower() for song in self.songs]
+        self.is_event = array.array('b', (song.is_event for song in self.songs))
+        self.columns = {}
+        for level in LEVELS:
+            stars, notes, kizuna = array.array('l'), array.array('l'), array.array('l')
+            for song in self.songs:
+                level_stars = getattr(song, level + '_difficulty')
+                level_notes = getattr(song, level + '_notes')
+                if not (level_stars and level_notes):
+                    # same rule as _get_song_level_info()
+                    level_stars = level_notes = 0
+                stars.append(level_stars)
+                notes.append(level_notes)
+                kizuna.append(_bond_points(level_notes))
+            self.columns[level, 'stars'] = stars
+            self.columns[level, 'notes'] = notes
+            self.columns[level, 'kizuna'] = kizuna
+
+    def __len__(self):
+        return len(self.songs)
+
+    def query(self, level, metric, descending=True, limit=5, conditions=(),
+              attribute=None, is_event=None, main_unit=None):
+        """Rank the songs that have ``level`` by one of its ``SONG_METRICS``.
+
+        :param list conditions: ``(metric, operator, value)`` comparisons
+                                that songs must pass, for the same ``level``
+        :return: ``(total, results)``, where ``total`` is how many songs
+                 matched and ``results`` is a list of up to ``limit``
+                 ``(song, value)`` pairs in rank order
+        :rtype: tuple
+        """
+        stars = self.columns[level, 'stars']
+        rows = [i for i in range(len(self.songs)) if stars[i]]
+        if attribute:
+            attributes = self.attributes
+            rows = [i for i in rows if attributes[i] == attribute]
+        if is_event is not None:
+            events = self.is_event
+            rows = [i for i in rows if events[i] == is_event]
+        if main_unit:
+            main_unit, units = main_unit.lower(), self.main_units
+            rows = [i for i in rows if units[i] == main_unit]
+        for cond_metric, op, value in conditions:
+            column, compare = self.columns[level, cond_metric], COMPARISONS[op]
+            rows = [i for i in rows if compare(column[i], value)]
+
+        column = self.columns[level, metric]
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        top = pick(limit, rows, key=column.__getitem__)
+        return len(rows), [(self.songs[i], column[i]) for i in top]
+
+
+def _parse_api_time(value):
+    """Turn an API timestamp into seconds since the epoch, or ``None``."""
+    if not value:
+        return None
+    when = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=UTC)
+    return when.timestamp()
+
+
+class IntervalIndex(object):
+    """Sorted intervals, for finding which ones overlap a point or a range.
+
+    Intervals are sorted by start, with a running maximum of their ends, so
+    a query is one binary search plus a walk back over only the intervals
+    that could still be open.
+    """
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=lambda interval: interval[0])
+        self.starts = [start for start, end, value in intervals]
+        self.ends = [end for start, end, value in intervals]
+        self.values = [value for start, end, value in intervals]
+        self._max_ends = list(itertools.accumulate(self.ends, max))
+
+    def __len__(self):
+        return len(self.values)
+
+    def overlapping(self, low, high):
+        """Get the values of intervals overlapping ``[low, high)``, by start."""
+        found = []
+        i = bisect.bisect_left(self.starts, high) - 1
+        while i >= 0 and self._max_ends[i] > low:
+            if self.ends[i] > low:
+                found.append(self.values[i])
+            i -= 1
+        found.reverse()
+        return found
+
+    def before(self, when):
+        """Get the value of the last interval to start before ``when``."""
+        i = bisect.bisect_left(self.starts, when)
+        return self.values[i - 1] if i else None
+
+    def after(self, when):
+        """Get the value of the first interval to start after ``when``."""
+        i = bisect.bisect_right(self.starts, when)
+        return self.values[i] if i < len(self.values) else None
+
+
+# Where events ran, and the Event fields holding their start and end times
+EVENT_REGIONS = (
+    ('ww', 'english_beginning', 'english_end'),
+    ('jp', 'beginning', 'end'),
+)
+
+
+class EventIndex(object):
+    """Every event, indexed by when it ran in each region and by name."""
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda event: event.beginning or '')
+        self.timelines = {}
+        for region, begin_field, end_field in EVENT_REGIONS:
+            intervals = []
+            for event in self.events:
+                start = _parse_api_time(getattr(event, begin_field))
+                end = _parse_api_time(getattr(event, end_field))
+                if start is not None and end is not None:
+                    intervals.append((start, end, event))
+            self.timelines[region] = IntervalIndex(intervals)
+
+        self._names = TrigramIndex()
+        for i, event in enumerate(self.events):
+            for name in set(filter(None, (
+                    event.japanese_name, event.romaji_name,
+                    event.english_name, event.translated_name))):
+                self._names.add(name, i)
+
+    def __len__(self):
+        return len(self.events)
+
+    def running(self, low, high):
+        """Get the events running in any region between two epoch times."""
+        found = []
+        for region, _, _ in EVENT_REGIONS:
+            for event in self.timelines[region].overlapping(low, high):
+                if event not in found:
+                    found.append(event)
+        return found
+
+    def find(self, name):
+        """Find an event by (part of) any of its names, allowing for typos."""
+        name = name.lower()
+        for event in self.events:
+            if any(name in (title or '').lower() for title in (
+                    event.japanese_name, event.romaji_name,
+                    event.english_name, event.translated_name)):
+                return event
+        matches = self._names.search(name, limit=1)
+        if matches and matches[0][0] >= FUZZY_MATCH_SCORE:
+            return self.events[matches[0][1]]
+        return None
+
+
+class IdolIndex(object):
+    """Every idol's profile, found by full name, nickname, or a close spelling."""
+    def __init__(self, idols):
+        self.idols = {idol.name.lower(): idol for idol in idols if idol.name}
+        self._names = TrigramIndex()
+        # any name word only one idol has, even the everyday ones that card
+        # searches leave alone (nobody looks up a profile for "you")
+        words = collections.defaultdict(set)
+        for key, idol in self.idols.items():
+            self._names.add(idol.name, key)
+            if idol.japanese_name:
+                self._names.add(idol.japanese_name, key)
+            for word in key.split():
+                words[word].add(key)
+        self._words = {
+            word: keys.pop() for word, keys in words.items() if len(keys) == 1}
+
+    def __len__(self):
+        return len(self.idols)
+
+    def find(self, name):
+        """Find an idol by name, trying the plugin's own name tables first.
+
+        :rtype: :class:`IdolProfile` or ``None``
+        """
+        name = ' '.join(name.lower().split())
+        known = IDOL_NICKNAMES.get(name.replace('-', ''), name)
+        known = IDOL_NAME_INDEX.get(known, known)
+        for key in (known, ' '.join(reversed(known.split())), name):
+            if key in self.idols:
+                return self.idols[key]
+        if name in self._words:
+            return self.idols[self._words[name]]
+        matches = self._names.search(name, limit=1)
+        if matches and matches[0][0] >= FUZZY_MATCH_SCORE:
+            return self.idols[matches[0][1]]
+        return None
+
+
+def _bond_points(combo):
+    """Get bond/kizuna points awarded for a given combo string."""
+    under_200 = min(200, combo)
+    over_200 = max(0, combo - 200)
+    return (
+        (combo // 10) +
+        (over_200 // 10) +
+        (4 * (combo // 50)) -
+        (over_200 // 50) +
+        (5 * (combo // 100))
+    )
+
+
+def _build_affix_index(table, suffixes=False):
+    """Map every prefix (and optionally suffix) of each key to its table value.
+
+    Exact keys always win. Otherwise keys are visited in table order and the
+    first one to claim a fragment keeps it, so ambiguous fragments resolve the
+    same way a linear ``startswith``/``endswith`` scan of the table would.
+    """
+    index = dict(table)
+    for key, value in table.items():
+        for i in range(len(key) + 1):
+            index.setdefault(key[:i], value)
+            if suffixes:
+                index.setdefault(key[i:], value)
+    return index
+
+
+@functools.lru_cache(maxsize=None)
+def _format_indexes():
+    """Get the attribute, idol, and unit formatting indexes.
+
+    Built once so that formatting is a single dict lookup, however many idols
+    (or units) get added to the tables above; but not until something needs
+    formatting, so importing the plugin stays cheap.
+    """
+    return (
+        _build_affix_index(_attribute_names()),
+        _build_affix_index(_idol_names(), suffixes=True),
+        _build_affix_index(_unit_names()),
+    )
+
+
+def format_attribute(attribute):
+    """Get formatted (colored, etc.) attribute string for output."""
+    return _format_indexes()[0][attribute.lower()]
+
+
+def format_idol(idol):
+    """Get formatted (colored, etc.) idol name string for output."""
+    # Not one of the main girls? No color for her.
+    return _format_indexes()[1].get(idol.lower(), idol)
+
+
+def format_unit(unit):
+    """Get formatted (colored, etc.) unit name string for output."""
+    if not unit:
+        # N cards, EXP/skill teachers, etc. don't have a unit name
+        return None
+
+    # Just give back the input unformatted if it's really, truly unknown
+    return _format_indexes()[2].get(unit.lower(), unit)
+
+
+def format_year(year):
+    """Get formatted school year string for output."""
+    try:
+        year = year.lower()
+    except AttributeError:
+        # Teacher cards and other specials don't have a year
+        return None
+
+    return YEARS[year]
+
+
+# Every special keyword either parser understands, mapped to what it means.
+# Tokens are compared lowercased with hyphens removed; see `_tokenize_query()`.
+QUERY_KEYWORDS = {'promo': ('promo', True), 'event': ('event', True)}
+for _token in ['nonpromo', '!promo']:
+    QUERY_KEYWORDS[_token] = ('promo', False)
+for _token in ['nonevent', '!event']:
+    QUERY_KEYWORDS[_token] = ('event', False)
+for _token in ATTRIBUTE_COLORS:
+    QUERY_KEYWORDS[_token] = ('attribute', _token.title())
+for _token, _rarity in RARITIES.items():
+    QUERY_KEYWORDS[_token] = ('rarity', _rarity)
+for _token, _idol in IDOL_NICKNAMES.items():
+    QUERY_KEYWORDS[_token] = ('idol', _idol)
+del _token, _rarity, _idol
+
+
+# Single idol names that are also everyday words (or parts of card titles),
+# so on their own they stay search text; "watanabe you" still finds You
+COMMON_WORD_NAMES = {
+    'ai', 'dia', 'emma', 'kira', 'mari', 'minami', 'ren', 'rin', 'ruby',
+    'shibuya', 'tang', 'verde', 'you', 'yuki',
+}
+
+
+def _build_idol_name_index():
+    """Map idol names, in either order, and unambiguous single names to idols.
+
+    Values are keys of ``IDOL_COLORS``. Given or family names shared by more
+    than one idol (Kurosawa, for one) are left out, as are
+    ``COMMON_WORD_NAMES``.
+    """
+    index = {}
+    seen = collections.Counter()
+    for idol in IDOL_COLORS:
+        words = idol.split()
+        index[' '.join(words)] = index[' '.join(reversed(words))] = idol
+        seen.update(words)
+    for idol in IDOL_COLORS:
+        for word in idol.split():
+            if seen[word] == 1 and word not in COMMON_WORD_NAMES:
+                index.setdefault(word, idol)
+    return index
+
+
+IDOL_NAME_INDEX = _build_idol_name_index()
+
+
+def _idol_filter_name(idol):
+    """Turn an ``IDOL_NAME_INDEX`` value (or a nickname's) into the API's spelling."""
+    idol = IDOL_NAME_INDEX.get(idol, idol)
+    return ' '.join(word.title() for word in idol.split())
+
+
+# Filter values accepted for `key:value` query terms
+YEAR_FILTERS = {
+    'first': 'First', '1': 'First', '1st': 'First',
+    'second': 'Second', '2': 'Second', '2nd': 'Second',
+    'third': 'Third', '3': 'Third', '3rd': 'Third',
+}
+_UNIT_FILTER_INDEX = _build_affix_index({key: key for key in UNIT_NAMES})
+# μ is hard to type on most keyboards
+_UNIT_FILTER_INDEX.update({'muse': 'μ\'s', 'us': 'μ\'s', 'u\'s': 'μ\'s'})
+
+# `id` comparisons, as Django-style filter names; the API can't do these,
+# so they're only ever evaluated against the local catalog
+ID_FILTERS = {
+    '>': 'id__gt',
+    '>=': 'id__gte',
+    '<': 'id__lt',
+    '<=': 'id__lte',
+}
+
+QUERY_TOKEN_PATTERN = re.compile(r'"([^"]*)"?|(\S+)')
+QUERY_FILTER_PATTERN = re.compile(r'^(year|unit|id)(:|>=|<=|>|<)(.+)$', re.IGNORECASE)
+
+
+def _tokenize_query(query):
+    """Split a plain-text query into classified tokens, in one pass.
+
+    :param str query: Search query, in plain text
+    :return: generator of ``(kind, value, extra, raw)`` tuples, where ``kind``
+             is ``'text'`` (a search word or quoted phrase), ``'keyword'`` (an
+             entry from ``QUERY_KEYWORDS``; ``value`` is its action and
+             ``extra`` its value), or ``'filter'`` (a ``key:value`` or ``id``
+             comparison term; ``value`` is the filter name and ``extra`` its
+             argument), and ``raw`` is the token as originally typed
+    :raise InvalidQueryError: when a filter term has an unusable value
+    """
+    for match in QUERY_TOKEN_PATTERN.finditer(query):
+        phrase, word = match.groups()
+        if word is None:
+            # quoted phrases are always literal search text
+            if phrase.strip():
+                yield 'text', phrase.strip(), None, match.group(0)
+            continue
+
+        # Use lowercase version with hyphens removed for comparisons
+        # Hyphen filter helps avoid duplicating too many IDOL_NICKNAMES mappings
+        # (The benefit of transforming to lowercase is obvious.)
+        _word = word.lower().replace('-', '')
+        if _word in QUERY_KEYWORDS:
+            action, value = QUERY_KEYWORDS[_word]
+            yield 'keyword', action, value, word
+            continue
+
+        term = QUERY_FILTER_PATTERN.match(word)
+        if term is None:
+            # Getting here means it's Just Another Keyword
+            yield 'text', word, None, word
+            continue
+
+        key, op, value = term.group(1).lower(), term.group(2), term.group(3)
+        if key == 'id':
+            card_id = _parse_id_filter(value)
+            # `id:N` is exact; express it as a closed range
+            for _op in (['>=', '<='] if op == ':' else [op]):
+                yield 'filter', ID_FILTERS[_op], card_id, word
+        elif op != ':':
+            raise InvalidQueryError("'{}' can't be compared with {}.".format(key, op))
+        elif key == 'year':
+            try:
+                yield 'filter', 'year', YEAR_FILTERS[value.lower()], word
+            except KeyError:
+                raise InvalidQueryError("Unknown school year '{}'.".format(value))
+        else:
+            try:
+                unit = _UNIT_FILTER_INDEX[value.lower()]
+            except KeyError:
+                raise InvalidQueryError("Unknown unit '{}'.".format(value))
+            yield (
+                'filter',
+                'main_unit' if unit in MAIN_UNITS else 'sub_unit',
+                UNIT_NAMES[unit],
+                word,
+            )
+
+
+def _parse_id_filter(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidQueryError("Card IDs are numbers, not '{}'.".format(value))
+
+
+def _maybe_name(token):
+    """Tell whether a ``_tokenize_query()`` token could be part of an idol's name."""
+    kind, _, _, raw = token
+    return kind in ('text', 'keyword') and not raw.startswith('"')
+
+
+def parse_card_query(query):
+    """Parse plain-text query into a tuple of card search parameters.
+
+    :param str query: Search query, in plain text, maybe containing keywords
+    :return: (text, attribute, rarity, want_promo, want_event, filters)
+    :rtype: tuple
+    :raise InvalidQueryError: when the query contains conflicting operators
+
+    ``filters`` is a dict of extra Django-style filter params (``name`` for
+    a recognized idol, ``idol_year``, ``idol_main_unit``, ``idol_sub_unit``,
+    ``id__gt``, etc.).
+    """
+    # Initialize state tracking
+    text = []
+    rarities = []
+    filters = {}
+    idols = set()
+    attribute = want_promo = want_event = None
+
+    tokens = list(_tokenize_query(query))
+    i = 0
+    while i < len(tokens):
+        kind, value, extra, raw = tokens[i]
+        i += 1
+        # full names come first: their parts may also be nicknames (Yuuki
+        # Anju's family name is Setsuna's nickname, for one)
+        if i < len(tokens) and _maybe_name(tokens[i - 1]) and _maybe_name(tokens[i]):
+            pair = '{} {}'.format(raw, tokens[i][3]).lower()
+            if pair in IDOL_NAME_INDEX:
+                idols.add(_idol_filter_name(pair))
+                i += 1
+                continue
+
+        if kind == 'text':
+            # (word, whether it was typed bare rather than quoted)
+            text.append((value, raw == value))
+        elif kind == 'filter':
+            if not value.startswith('id__'):
+                # year and unit filters apply to the card's idol
+                value = 'idol_' + value
+            filters[value] = extra
+        elif value == 'attribute':
+            if attribute:
+                # Can't search for multiple attributes (they're mutually exclusive)
+                raise InvalidQueryError("You cannot search for multiple attributes.")
+            attribute = extra
+        elif value == 'rarity':
+            rarities.append(extra)
+        elif value == 'promo':
+            want_promo = extra
+        elif value == 'event':
+            want_event = extra
+        elif value == 'idol':
+            idols.add(_idol_filter_name(extra))
+
+    # single idol names (bare, not quoted) become an exact filter instead of text
+    words = []
+    for word, bare in text:
+        if bare and word.lower() in IDOL_NAME_INDEX:
+            idols.add(_idol_filter_name(word.lower()))
+        else:
+            words.append(word)
+
+    if len(idols) > 1:
+        raise InvalidQueryError("You cannot search for multiple idols.")
+    if idols:
+        filters['name'] = idols.pop()
+
+    return ' '.join(words), attribute, ','.join(rarities), want_promo, want_event, filters
+
+
+def parse_song_query(query):
+    """Parse plain-text query into a tuple of song search parameters.
+
+    :param str query: Search query, in plain text, maybe containing keywords
+    :return: (text, attribute, is_event, filters)
+    :rtype: tuple
+    :raise InvalidQueryError: when the query contains conflicting operators
+
+    ``filters`` is a dict of extra filter params (currently only ``main_unit``).
+    """
+    # Initialize state tracking
+    text = []
+    filters = {}
+    attribute = is_event = None
+
+    for kind, value, extra, raw in _tokenize_query(query):
+        if kind == 'filter':
+            if value != 'main_unit':
+                raise InvalidQueryError("Songs can only be filtered by main unit.")
+            filters[value] = extra
+        elif kind == 'keyword' and value == 'attribute':
+            if attribute:
+                # Can't search for multiple attributes (they're mutually exclusive)
+                raise InvalidQueryError("You cannot search for multiple attributes.")
+            attribute = extra
+        elif kind == 'keyword' and value == 'event':
+            is_event = extra
+        else:
+            # Card-only keywords are Just Another Keyword in song titles
+            text.append(value if kind == 'text' else raw)
+
+    return ' '.join(text), attribute, is_event, filters
+
+
+# Words .sifsongs understands on top of parse_song_query()'s keywords
+SONGS_METRIC_WORDS = {
+    'stars': 'stars', 'star': 'stars', 'difficulty': 'stars',
+    'notes': 'notes', 'note': 'notes', 'combo': 'notes',
+    'kizuna': 'kizuna', 'bond': 'kizuna',
+}
+SONGS_ORDER_WORDS = {
+    'top': True, 'most': True, 'highest': True,
+    'bottom': False, 'fewest': False, 'least': False, 'lowest': False,
+}
+SONGS_CONDITION_PATTERN = re.compile(
+    r'^({})(>=|<=|>|<|:|=)(\d+)$'.format('|'.join(SONGS_METRIC_WORDS)), re.IGNORECASE)
+SONGS_DEFAULT_RESULTS = 5
+SONGS_MAX_RESULTS = 10
+
+
+def parse_songs_query(query):
+    """Parse a plain-text song ranking query.
+
+    :param str query: e.g. "top 5 smile master kizuna" or "expert notes>=700"
+    :return: (level, metric, descending, limit, conditions, attribute,
+             is_event, filters)
+    :rtype: tuple
+    :raise InvalidQueryError: when the query contains anything that isn't
+                              a ranking word or a song search keyword
+    """
+    level, metric, descending = None, None, True
+    limit = SONGS_DEFAULT_RESULTS
+    conditions = []
+    rest = []
+
+    for word in (query or '').split():
+        _word = word.lower()
+        term = SONGS_CONDITION_PATTERN.match(word)
+        if _word in LEVELS:
+            if level and level != _word:
+                raise InvalidQueryError("You can only rank songs by one difficulty.")
+            level = _word
+        elif _word in SONGS_METRIC_WORDS:
+            metric = SONGS_METRIC_WORDS[_word]
+        elif _word in SONGS_ORDER_WORDS:
+            descending = SONGS_ORDER_WORDS[_word]
+        elif _word.isdigit():
+            limit = max(1, min(int(_word), SONGS_MAX_RESULTS))
+        elif term is not None:
+            conditions.append((
+                SONGS_METRIC_WORDS[term.group(1).lower()],
+                term.group(2),
+                int(term.group(3)),
+            ))
+        else:
+            rest.append(word)
+
+    text, attribute, is_event, filters = parse_song_query(' '.join(rest))
+    if text:
+        raise InvalidQueryError("Unknown word(s): {}".format(text))
+    if metric is None:
+        # rank by what the conditions are about, if there are any
+        metric = conditions[-1][0] if conditions else 'notes'
+
+    return (level or 'master', metric, descending, limit, conditions,
+            attribute, is_event, filters)
+
+
+def _format_card(card, prefix=''):
+    """Render a card as a line of IRC output.
+
+    :param card: the card to render
+    :type card: :class:`Card`
+    :param str prefix: text to put before the card info
+    :rtype: str
+    """
+    card_id = card.id
+    character = format_idol(card.idol.name)
+    school = card.idol.school
+    attribute = format_attribute(card.attribute)
+    rarity = card.rarity
+    if card.is_promo:
+        rarity = "Promo " + rarity
+    if card.is_special:
+        rarity = "Special " + rarity
+    released = card.release_date
+    link = card.website_url.replace('http:', 'https:', 1)
+    # remove stupid trailing directory after card ID
+    link = CARD_LINK_PATTERN.sub(r'\1', link)
+
+    idol = card.idol
+    types = ', '.join(filter(None, [
+        format_unit(idol.main_unit),
+        format_year(idol.year),
+        format_unit(idol.sub_unit),
+    ]))
+
+    collection = card.translated_collection
+    if not collection:
+        # No localized name; use Japanese
+        collection = card.japanese_collection
+        if not collection:
+            # No Japanese name either?! Give up, then.
+            pass
+        else:
+            # Quote name in Japanese style
+            collection = "「{}」".format(collection)
+    else:
+        # Quote name in English style
+        collection = '"{}"'.format(collection)
+
+    card_extras = ' | '.join(filter(None, [
+        types or '',
         school or '',
         '{} set'.format(collection) if collection else '',
     ]))
     if card_extras:
         card_extras = ' | {}'.format(card_extras)
 
-    bot.say("{}[#{}] {} | {} | {}{} | Released: {} | {}".format(
-        prefix,
-        card_id,
-        character,
-        attribute,
+    return "{}[#{}] {} | {} | {}{} | Released: {} | {}".format(
+        prefix,
+        card_id,
+        character,
+        attribute,
+        rarity,
+        card_extras,
+        released,
+        link,
+    )
+
+
+def _parse_card_ids(arg, limit):
+    """Parse a list of card IDs and ID ranges (e.g. ``1201 1205-1208``).
+
+    :param str arg: space-separated IDs and/or hyphenated ranges
+    :param int limit: the most IDs to allow
+    :return: the IDs, in the order given, without duplicates
+    :rtype: list
+    :raise InvalidQueryError: if a range is backwards or there are too many IDs
+    """
+    ids = []
+    for match in CARD_ID_PATTERN.finditer(arg):
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if last < first:
+            raise InvalidQueryError("Range {} is backwards.".format(match.group(0)))
+        if last - first >= limit:
+            # don't build a giant list just to reject it
+            raise InvalidQueryError("You can only look up {} cards at once.".format(limit))
+        ids.extend(card_id for card_id in range(first, last + 1) if card_id not in ids)
+
+    if len(ids) > limit:
+        raise InvalidQueryError("You can only look up {} cards at once.".format(limit))
+    return ids
+
+
+def _get_cards(bot, ids, channel=None):
+    """Get several cards by ID, from the local catalog or in one API request.
+
+    Only IDs the catalog doesn't have are asked of the API, and none at all
+    once the catalog is complete.
+
+    :param bot: the bot instance
+    :param list ids: card IDs to look up
+    :param str channel: where the lookup came from
+    :return: the cards found, keyed by ID
+    :rtype: dict
+    :raise APIError: if there is an error accessing the API
+    :raise BusyError: if too many API lookups are already waiting
+    """
+    cards = {}
+    catalog = bot.memory.get('llsif_catalog')
+    if catalog:
+        for card_id in ids:
+            card = catalog.get_card(card_id)
+            if card is not None:
+                cards[card_id] = card
+
+    missing = [card_id for card_id in ids if card_id not in cards]
+    # a complete catalog already knows those cards don't exist
+    if missing and not (catalog and catalog.is_complete('cards')):
+        data = _api_call(bot, CARD_API, {
+            'ids': ','.join(str(card_id) for card_id in missing),
+            'page_size': len(missing),
+        }, channel)
+        found = data['results']
+        cards.update((card.id, card) for card in found)
+        if catalog and found:
+            catalog.store_cards(found)
+
+    return cards
+
+
+class RenderCache(object):
+    """Bounded LRU cache of fully rendered output lines.
+
+    Each line is stored with the record it was rendered from, and is only
+    reused for an equal record; a changed card or song renders afresh.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, record):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != record:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, record, line):
+        with self._lock:
+            self._entries[key] = (record, line)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _use_color(bot, channel):
+    """Check whether output to ``channel`` may use IRC formatting."""
+    plain_channels = bot.config.llsif.plain_channels
+    return not (plain_channels and channel and channel.lower() in (
+        name.lower() for name in plain_channels))
+
+
+def _render(bot, record, channel, prefix=''):
+    """Render a card or song for output to ``channel``, reusing earlier output.
+
+    :param record: the card or song to render
+    :type record: :class:`Card` or :class:`Song`
+    :param str channel: where the line will be sent
+    :param str prefix: text to put before the card info (cards only)
+    :rtype: str
+    """
+    color = _use_color(bot, channel)
+    if isinstance(record, Card):
+        key = ('card', record.id, prefix, color)
+    else:
+        key = ('song', record.name, prefix, color)
+
+    cache = bot.memory.get('llsif_render_cache')
+    line = cache.get(key, record) if cache else None
+    if line is None:
+        if isinstance(record, Card):
+            line = _format_card(record, prefix)
+        else:
+            line = prefix + _format_song(record)
+        if not color:
+            line = formatting.plain(line)
+        if cache:
+            cache.put(key, record, line)
+    return line
+
+
+@module.commands('sifcard')
+@module.example('.sifcard')
+@module.example('.sifcard jp')
+@module.example('.sifcard 123')
+@module.example('.sifcard 1201 1205-1208')
+@module.example('.sifcard birthday maki ur')
+@module.example('.sifcard maki year:first id>1000')
+@_instrumented('sifcard')
+def sif_card(bot, trigger):
+    """Fetch LLSIF EN/WW card information.
+
+    Search by card number/ID (or several, e.g. "1201 1205-1208"), or by keywords.
+
+    Special keywords: attribute (Smile/Pure/Cool/All), rarity (N/R/SR/SSR/UR), event/non-event, promo/non-promo
+
+    Filters: year:first/second/third, unit:<name>, id>N (also <, >=, <=, and id:N). Use "quotes" to search for keywords as text.
+    """
+    arg = trigger.group(2)
+    params = {}
+    url = CARD_API
+    catalog = bot.memory.get('llsif_catalog')
+    card = None
+    source = 'catalog'
+    if arg is None or arg.lower() in ['en', 'ww']:
+        params = LATEST_CARD_PARAMS
+        prefix = "Latest SIF EN/WW card: "
+        if catalog:
+            card = catalog.latest_card(japan_only=False)
+    elif arg.lower() == 'jp':
+        params = LATEST_CARD_PARAMS.copy()
+        del params['japan_only']
+        prefix = "Latest SIF JP card: "
+        if catalog:
+            card = catalog.latest_card(japan_only=True)
+    elif CARD_IDS_PATTERN.match(arg):
+        # several IDs and/or ID ranges get looked up in one go
+        return _sif_card_batch(bot, trigger.sender, arg)
+    else:
+        prefix = ""
+        if NON_DIGIT_PATTERN.search(arg):
+            # non-digits in query means run a keyword search
+            params = COMMON_SEARCH_PARAMS.copy()
+            try:
+                text, attribute, rarities, promo, event, filters = parse_card_query(arg)
+            except InvalidQueryError as err:
+                return bot.reply("You have an error in your query: {}".format(err))
+            params.update({
+                'search': text,
+                'attribute': attribute,
+                'rarity': rarities,
+                'is_promo': promo,
+                'is_event': event,
+            })
+            try:
+                local_only = _check_id_range(catalog, filters)
+            except InvalidQueryError as err:
+                return bot.reply(str(err))
+            # a partial catalog can't know which matching cards it's missing
+            if catalog and catalog.is_complete('cards'):
+                card = catalog.search_cards(
+                    text, attribute, rarities, promo, event, filters)
+                if card is None and text and catalog.is_complete('cards'):
+                    # every card is local, so try correcting typos instead
+                    # of asking the API
+                    corrected = _fuzzy_card_text(catalog, text)
+                    if corrected:
+                        card = catalog.search_cards(
+                            corrected, attribute, rarities, promo, event, filters)
+                    if card is None:
+                        return bot.reply("No card found!")
+                    source = 'fuzzy'
+                    prefix = 'Showing results for "{}": '.format(corrected)
+                if card is None and local_only:
+                    return bot.reply("No card found!")
+            params.update(filters)
+        else:
+            # query of only digits means run an ID number lookup
+            url = CARD_ONE.format(arg)
+            if catalog:
+                card = catalog.get_card(int(arg))
+
+    _stats(bot).count('lookups', 'card', 'api' if card is None else source)
+    if card is None:
+        # not in the local catalog (or no catalog); ask the API
+        try:
+            data = _api_call(bot, url, params, trigger.sender)
+        except BusyError:
+            bot.reply(BUSY_MESSAGE)
+            return
+        except APIError as err:
+            bot.say("Sorry, something went wrong with the card API.")
+            LOGGER.exception("LLSIF API error!")
+            return
+
+        if isinstance(data, Card):
+            card = data
+        else:
+            try:
+                card = data['results'][0]
+            except IndexError:
+                bot.reply("No card found!")
+                return
+
+        if catalog:
+            catalog.store_cards([card])
+
+    bot.say(_render(bot, card, trigger.sender, prefix))
+
+
+def _sif_card_batch(bot, channel, arg):
+    try:
+        ids = _parse_card_ids(arg, bot.config.llsif.max_batch_cards)
+    except InvalidQueryError as err:
+        return bot.reply("You have an error in your query: {}".format(err))
+
+    try:
+        cards = _get_cards(bot, ids, channel)
+    except BusyError:
+        bot.reply(BUSY_MESSAGE)
+        return
+    except APIError:
+        bot.say("Sorry, something went wrong with the card API.")
+        LOGGER.exception("LLSIF API error!")
+        return
+
+    # send everything in one go, in the order asked for
+    lines = [
+        _render(bot, cards[card_id], channel)
+        for card_id in ids if card_id in cards
+    ]
+    missing = [str(card_id) for card_id in ids if card_id not in cards]
+    if missing:
+        lines.append("No card found with ID: {}".format(', '.join(missing)))
+    for line in lines:
+        bot.say(line)
+
+
+CardCursor = collections.namedtuple('CardCursor', ['query', 'page', 'total', 'stamp'])
+
+
+class SearchCursors(object):
+    """Each channel's latest ``.sifcards`` search, so ``.more`` can continue it.
+
+    Cursors expire after ``timeout`` seconds, and only the ``max_entries``
+    most recently used are kept (private messages get one each, too).
+    """
+    def __init__(self, timeout, max_entries=256):
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self._cursors = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, channel):
+        key = channel.lower()
+        with self._lock:
+            cursor = self._cursors.get(key)
+            if cursor is None:
+                return None
+            if time.monotonic() - cursor.stamp > self.timeout:
+                del self._cursors[key]
+                return None
+            return cursor
+
+    def put(self, channel, query, page, total):
+        key = channel.lower()
+        with self._lock:
+            self._cursors[key] = CardCursor(query, page, total, time.monotonic())
+            self._cursors.move_to_end(key)
+            while len(self._cursors) > self.max_entries:
+                self._cursors.popitem(last=False)
+
+    def pop(self, channel):
+        with self._lock:
+            self._cursors.pop(channel.lower(), None)
+
+
+def _card_page_params(query, page, per_page):
+    """Build API params for one page of a ``parse_card_query()`` search."""
+    text, attribute, rarities, promo, event, filters = query
+    params = {
+        'search': text,
+        'attribute': attribute,
+        'rarity': rarities,
+        'is_promo': promo,
+        'is_event': event,
+        'page': page,
+        'page_size': per_page,
+    }
+    params.update(filters)
+    return params
+
+
+def _check_id_range(catalog, filters):
+    """Make sure a search by ID range can be answered from the local catalog.
+
+    The API can't filter by ID range, and a catalog that is still syncing
+    can't know which cards in the range it's missing.
+
+    :param catalog: the local catalog, if there is one
+    :param dict filters: ``parse_card_query()``'s filters
+    :return: whether the search has an ID range
+    :rtype: bool
+    :raise InvalidQueryError: if there is no complete card catalog to search
+    """
+    if not any(key.startswith('id__') for key in filters):
+        return False
+    if not catalog:
+        raise InvalidQueryError("Searching by ID range needs the local card catalog.")
+    if not catalog.is_complete('cards'):
+        raise InvalidQueryError(
+            "Searching by ID range needs a synced card catalog; "
+            "please try again once it has every card.")
+    return True
+
+
+def _get_card_page(bot, query, page, channel=None):
+    """Get one page of card search results, from the local catalog or the API.
+
+    After an API page, the next one is requested in the background so that
+    ``.more`` finds it already cached.
+
+    :param tuple query: ``parse_card_query()``'s output
+    :param int page: which page, counting from 1
+    :param str channel: where the search came from
+    :return: ``(total, cards)``
+    :rtype: tuple
+    :raise InvalidQueryError: if the query needs a complete local catalog there isn't
+    :raise APIError: if there is an error accessing the API
+    :raise BusyError: if too many API lookups are already waiting
+    """
+    per_page = bot.config.llsif.cards_per_page
+    catalog = bot.memory.get('llsif_catalog')
+    _check_id_range(catalog, query[5])
+    if catalog and catalog.is_complete('cards'):
+        _stats(bot).count('lookups', 'cards', 'catalog')
+        return catalog.search_card_page(query, (page - 1) * per_page, per_page)
+
+    _stats(bot).count('lookups', 'cards', 'api')
+    data = _api_call(bot, CARD_API, _card_page_params(query, page, per_page), channel)
+    cards = data['results']
+    if catalog:
+        catalog.store_cards(cards)
+    if data.get('next'):
+        try:
+            _api_start(
+                bot, CARD_API, _card_page_params(query, page + 1, per_page), channel)
+        except BusyError:
+            # only a prefetch; .more will just have to wait for it
+            pass
+    total = data.get('count')
+    return (len(cards) if total is None else total), cards
+
+
+def _format_card_brief(card):
+    """Render a card as a short item in a list of search results."""
+    rarity = card.rarity
+    if card.is_promo:
+        rarity = "Promo " + rarity
+    collection = card.translated_collection or card.japanese_collection
+    return "[#{}] {} {} {}{}".format(
+        card.id,
+        format_idol(card.idol.name),
+        format_attribute(card.attribute),
         rarity,
-        card_extras,
-        released,
-        link,
-    ))
+        ' ({})'.format(collection) if collection else '',
+    )
+
+
+def _show_card_page(bot, trigger, query, page):
+    channel = trigger.sender
+    cursors = bot.memory.get('llsif_cursors')
+    try:
+        total, cards = _get_card_page(bot, query, page, channel)
+    except InvalidQueryError as err:
+        bot.reply("You have an error in your query: {}".format(err))
+        return
+    except BusyError:
+        bot.reply(BUSY_MESSAGE)
+        return
+    except APIError:
+        bot.say("Sorry, something went wrong with the card API.")
+        LOGGER.exception("LLSIF API error!")
+        return
+
+    if not cards:
+        if cursors:
+            cursors.pop(channel)
+        bot.reply("No card found!" if page == 1 else "No more results.")
+        return
+
+    per_page = bot.config.llsif.cards_per_page
+    first = (page - 1) * per_page + 1
+    last = first + len(cards) - 1
+    more = last < total
+    if cursors:
+        if more:
+            cursors.put(channel, query, page, total)
+        else:
+            cursors.pop(channel)
+
+    line = "{} of {}: {}{}".format(
+        'Card {}'.format(first) if first == last else 'Cards {}–{}'.format(first, last),
+        total,
+        ' | '.join(_format_card_brief(card) for card in cards),
+        ' — .more for the rest' if more else '',
+    )
+    bot.say(line if _use_color(bot, channel) else formatting.plain(line))
+
+
+@module.commands('sifcards')
+@module.example('.sifcards birthday maki ur')
+@module.example('.sifcards unit:bibi ssr')
+@_instrumented('sifcards')
+def sif_cards(bot, trigger):
+    """Search LLSIF EN/WW cards, showing several results at a time.
+
+    Takes the same keywords and filters as .sifcard. Use .more to see the
+    next page of results.
+    """
+    arg = trigger.group(2)
+    if not arg:
+        bot.reply("Search for what?")
+        return
+    try:
+        query = parse_card_query(arg)
+    except InvalidQueryError as err:
+        bot.reply("You have an error in your query: {}".format(err))
+        return
+    _show_card_page(bot, trigger, query, 1)
+
+
+@module.commands('more')
+@_instrumented('more')
+def sif_more(bot, trigger):
+    """Show the next page of this channel's last .sifcards search."""
+    cursors = bot.memory.get('llsif_cursors')
+    cursor = cursors.get(trigger.sender) if cursors else None
+    if cursor is None:
+        bot.reply("Nothing more to show; search with .sifcards first.")
+        return
+    _show_card_page(bot, trigger, cursor.query, cursor.page + 1)
+
+
+class CatalogSync(object):
+    """Fill the local catalog in the background, then keep it up to date.
+
+    The first card sync pages through the whole card list in ID order,
+    remembering its place so it can resume after a restart. Once that has
+    finished, later syncs page backwards from the newest card and stop at the
+    first one already stored. Songs have no IDs to go by (and stopped
+    changing with the game), so they're synced in full until complete.
+    """
+    def __init__(self, bot, catalog):
+        self.bot = bot
+        self.catalog = catalog
+        self.config = bot.config.llsif
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='llsif-sync', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _run(self):
+        interval = self.config.sync_interval * 60 * 60
+        backoff = max(1.0, self.config.sync_delay)
+        while not self._cancelled.is_set():
+            failed = True
+            try:
+                self.sync_cards()
+                self.sync_songs()
+                failed = False
+            except APIError:
+                LOGGER.exception("LLSIF API error during catalog sync; will retry.")
+            except Exception:
+                LOGGER.exception("Unexpected error during LLSIF catalog sync!")
+
+            wait = interval
+            if failed and not (self.catalog.is_complete('cards')
+                               and self.catalog.is_complete('songs')):
+                # still warming up: pick up where it stopped soon, not in a day
+                wait = min(backoff, interval)
+                backoff *= 2
+            else:
+                backoff = max(1.0, self.config.sync_delay)
+            if self._cancelled.wait(wait):
+                return
+
+    def _pages(self, url, params, first_page=1):
+        """Yield ``(page_number, page)`` for each page of results, throttled."""
+        page = first_page
+        while page and not self._cancelled.is_set():
+            params = dict(params, page=page, page_size=self.config.sync_page_size)
+            # straight to the API: pages of everything would just crowd the
+            # cache and the validator store
+            data = _api_fetch(self.bot, url, params, revalidate=False)[0]
+            last = _is_last_page(data, url, page)
+            yield page, data
+
+            page = None if last else page + 1
+            if (page and self.config.sync_progress_pages
+                    and page % self.config.sync_progress_pages == 0):
+                LOGGER.info("LLSIF catalog sync: fetched %d pages from %s", page - 1, url)
+            if page and self._cancelled.wait(self.config.sync_delay):
+                return
+
+    def sync_cards(self):
+        if not self.catalog.is_complete('cards'):
+            first_page = int(self.catalog.get_meta('cards_sync_page', 1))
+            for page, data in self._pages(CARD_API, {'ordering': 'id'}, first_page):
+                self.catalog.store_cards(data['results'])
+                if data.get('next'):
+                    # ID order keeps earlier pages stable as new cards appear
+                    self.catalog.set_meta('cards_sync_page', str(page + 1))
+                elif self.catalog.count('cards') >= data['count']:
+                    self.catalog.set_complete('cards')
+                    LOGGER.info("LLSIF catalog sync: all cards stored.")
+                else:
+                    # pages shifted under us somehow; go through them again
+                    self.catalog.set_meta('cards_sync_page', '1')
+                    raise APIError("Card sync ended with {} of {} cards stored.".format(
+                        self.catalog.count('cards'), data['count']))
+            return
+
+        newest = self.catalog.max_card_id() or 0
+        added = 0
+        for _, data in self._pages(CARD_API, {'ordering': '-id'}):
+            new = [card for card in data['results'] if card.id > newest]
+            self.catalog.store_cards(new)
+            added += len(new)
+            if len(new) < len(data['results']):
+                # reached cards we already had
+                break
+        LOGGER.info("LLSIF catalog sync: %d new cards.", added)
+
+    def sync_songs(self):
+        if self.catalog.is_complete('songs'):
+            return
+        for _, data in self._pages(SONG_API, {'ordering': 'name'}):
+            self.catalog.store_songs(data['results'])
+            if not data.get('next'):
+                if self.catalog.count('songs') < data['count']:
+                    raise APIError("Song sync ended with {} of {} songs stored.".format(
+                        self.catalog.count('songs'), data['count']))
+                self.catalog.set_complete('songs')
+                LOGGER.info("LLSIF catalog sync: all songs stored.")
+
+
+class SongDeck(object):
+    """Deal random songs from a shuffled deck, without repeats until it runs out.
+
+    The full list of song names is loaded once, on the first draw; each
+    channel (or the whole bot, if ``per_channel`` is false) then gets its own
+    shuffled copy, reshuffled whenever it's used up.
+    """
+    def __init__(self, per_channel=True):
+        self.per_channel = per_channel
+        self._names = []
+        self._decks = {}
+        self._lock = threading.Lock()
+
+    def draw(self, channel, load):
+        """Draw a song name.
+
+        :param channel: the channel asking, if any
+        :param load: callable returning every song name, used on first draw
+        :raise NoResultError: if there are no songs at all
+        """
+        with self._lock:
+            if not self._names:
+                self._names = list(load())
+                if not self._names:
+                    raise NoResultError
+
+            key = channel if self.per_channel else None
+            deck = self._decks.get(key)
+            if not deck:
+                deck = self._decks[key] = self._names[:]
+                random.shuffle(deck)
+            return deck.pop()
+
+
+def _load_song_names(bot, channel=None):
+    """Get every song name, from a complete local catalog or by paging the API.
+
+    Songs paged in from the API are saved to the catalog along the way, and
+    the catalog's songs are marked complete once every page has come back.
+
+    :param str channel: where the lookup that needs the names came from
+    :raise APIError: if a page fails, or the pages don't add up to every song
+    """
+    catalog = bot.memory.get('llsif_catalog')
+    if catalog and catalog.is_complete('songs'):
+        return catalog.song_names()
+
+    names = []
+    page = 1
+    while page:
+        data = _api_call(bot, SONG_API, {'page_size': 100, 'page': page}, channel)
+        last = _is_last_page(data, SONG_API, page)
+        songs = data['results']
+        names.extend(song.name for song in songs)
+        if catalog:
+            catalog.store_songs(songs)
+        page = None if last else page + 1
+
+    if len(names) < data['count']:
+        raise APIError("Got {} of {} songs.".format(len(names), data['count']))
+    if catalog:
+        catalog.set_complete('songs')
+    return names
+
+
+def _draw_song(bot, channel):
+    """Get a random song from the deck, without asking the API to pick one."""
+    deck = bot.memory['llsif_song_deck']
+    name = deck.draw(channel, lambda: _load_song_names(bot, channel))
+
+    catalog = bot.memory.get('llsif_catalog')
+    if catalog:
+        song = catalog.get_song(name)
+        if song is not None:
+            return song
+
+    data = _api_call(
+        bot, SONG_ONE.format(urllib.parse.quote(name, safe='')), channel=channel)
+    if not isinstance(data, Song):
+        # 404; the song must have been removed since the deck was loaded
+        raise NoResultError
+
+    if catalog:
+        catalog.store_songs([data])
+    return data
 
 
-def _get_song(query):
-    """Get a song from the API that matches the query.
+def _get_song(bot, query, channel=None):
+    """Get a song that matches the query, from the local catalog or the API.
 
+    :param bot: the bot instance (for access to the local catalog)
     :param str query: the user's search query
-    :return: the song object
-    :rtype: dict
+    :param str channel: where the query came from (for random song decks)
+    :return: the song
+    :rtype: :class:`Song`
     :raise NoResultError: if the query doesn't match any songs
     :raise APIError: if there is an error accessing the API
+    :raise BusyError: if too many API lookups are already waiting
     :raise InvalidQueryError: if the query contains conflicting operators
     """
+    if not query and 'llsif_song_deck' in bot.memory:
+        try:
+            return _draw_song(bot, channel)
+        except APIError:
+            LOGGER.exception("LLSIF API error!")
+            raise
+
     params = COMMON_SEARCH_PARAMS.copy()
+    filters = {}
     if query:
-        text, attribute, is_event = parse_song_query(query)
+        text, attribute, is_event, filters = parse_song_query(query)
         params.update({
             'search': text,
             'attribute': attribute,
             'is_event': is_event,
         })
+        params.update(filters)
 
     if not query or not text:
         params.update({'ordering': 'random'})
 
+    catalog = bot.memory.get('llsif_catalog')
+    # a partial catalog can't know which matching songs it's missing
+    if catalog and catalog.is_complete('songs'):
+        song = catalog.search_songs(
+            params.get('search'), params.get('attribute'), params.get('is_event'),
+            filters)
+        if song is not None:
+            _stats(bot).count('lookups', 'song', 'catalog')
+            return song
+        if query and text:
+            # the catalog has every song, so a miss here is most likely a
+            # typo; no need to ask the API
+            return _fuzzy_song(bot, catalog, text, attribute, is_event, filters)
+
+    _stats(bot).count('lookups', 'song', 'api')
+
     try:
-        data = _api_request(SONG_API, params)
+        data = _api_call(bot, SONG_API, params, channel)
     except APIError:
         LOGGER.exception("LLSIF API error!")
         raise
@@ -619,11 +3759,53 @@ def _get_song(query):
     try:
         song = data['results'][0]
     except IndexError:
+        if catalog and query and text:
+            return _fuzzy_song(bot, catalog, text, attribute, is_event, filters)
         raise NoResultError
 
+    if catalog:
+        catalog.store_songs([song])
+
     return song
 
 
+def _fuzzy_song(bot, catalog, text, attribute, is_event, filters):
+    """Find the song whose title is closest to a (probably misspelled) query.
+
+    :return: the best match, if it is close enough and passes the other filters
+    :rtype: :class:`Song`
+    :raise NoResultError: with any near misses as suggestions
+    """
+    candidates = catalog.song_index().search(text, limit=5)
+    for score, name in candidates:
+        if score < FUZZY_MATCH_SCORE:
+            break
+        song = catalog.search_songs(
+            None, attribute, is_event, filters, name=name)
+        if song is not None:
+            _stats(bot).count('lookups', 'song', 'fuzzy')
+            return song
+    raise NoResultError(
+        [name for score, name in candidates if score >= FUZZY_SUGGEST_SCORE][:3])
+
+
+def _fuzzy_card_text(catalog, text):
+    """Replace unknown words in card search text with their closest known words.
+
+    :return: the corrected text, or ``None`` if nothing could be corrected
+    :rtype: str
+    """
+    index = catalog.card_word_index()
+    words, changed = [], False
+    for word in text.lower().split():
+        if word not in index:
+            matches = index.search(word, limit=1)
+            if matches and matches[0][0] >= FUZZY_MATCH_SCORE:
+                word, changed = matches[0][1], True
+        words.append(word)
+    return ' '.join(words) if changed else None
+
+
 def _get_song_level_info(song):
     info = {}
 
@@ -631,64 +3813,392 @@ def _get_song_level_info(song):
         key_notes = level + '_notes'
         key_stars = level + '_difficulty'
         # skip difficulty level if it has null for either value
-        if song[key_notes] and song[key_stars]:
+        notes = getattr(song, key_notes)
+        stars = getattr(song, key_stars)
+        if notes and stars:
             info[level] = {
-                'stars': song[key_stars],
-                'notes': song[key_notes],
+                'stars': stars,
+                'notes': notes,
             }
 
     return info
 
 
+def _format_song(song):
+    """Render a song as a line of IRC output.
+
+    :param song: the song to render
+    :type song: :class:`Song`
+    :rtype: str
+    """
+    title = formatting.hex_color(song.name, ATTRIBUTE_COLORS[song.attribute.lower()])
+    romaji_title = song.romaji_name
+    english_title = song.translated_name
+    main_unit = format_unit(song.main_unit)
+    attribute = format_attribute(song.attribute)
+    rotation = song.daily_rotation or 'A'  # API gives null if not B-sides, for some reason
+    duration = song.time
+    if duration is None:
+        duration = '?:??'
+    else:
+        duration = "{}:{:0>2}".format(duration // 60, duration % 60)
+
+    difficulties = [
+        '{}: {}🟊, {} notes, {} kizuna'.format(
+            level.title(),
+            info['stars'],
+            info['notes'],
+            _bond_points(info['notes']),
+        ) for level, info in _get_song_level_info(song).items()
+    ]
+
+    return "{}{} [{}] | {}, in {} {} — {}".format(
+        title,
+        ' ({})'.format(formatting.italic(romaji_title)) if romaji_title else '',
+        duration,
+        attribute,
+        main_unit,
+        'Hits' if rotation == 'A' else 'B-sides',
+        ' | '.join(difficulties),
+    )
+
+
 @module.commands('sifsong')
 @module.example('.sifsong snow halation')
+@_instrumented('sifsong')
 def sif_song(bot, trigger):
     """Look up LLSIF live show information.
 
     Special keywords: song attribute (Smile, Pure, Cool), and whether the song
-    was an event song (event, !event, or non-event).
+    was an event song (event, !event, or non-event). Filter by unit with
+    unit:<name>, and use "quotes" to search for keywords as text.
     """
     try:
-        song = _get_song(trigger.group(2))
+        song = _get_song(bot, trigger.group(2), trigger.sender)
     except APIError:
         bot.say("Sorry, something went wrong with the song API.")
         return
-    except NoResultError:
-        bot.reply("No song found!")
+    except BusyError:
+        bot.reply(BUSY_MESSAGE)
+        return
+    except NoResultError as err:
+        if err.suggestions:
+            bot.reply("No song found! Did you mean: {}?".format(
+                ', '.join(err.suggestions)))
+        else:
+            bot.reply("No song found!")
         return
     except InvalidQueryError as err:
         bot.reply("You have an error in your query: {}".format(err))
         return
 
-    title = formatting.hex_color(song['name'], ATTRIBUTE_COLORS[song['attribute'].lower()])
-    romaji_title = song['romaji_name']
-    english_title = song['translated_name']
-    main_unit = format_unit(song['main_unit'])
-    attribute = format_attribute(song['attribute'])
-    rotation = song['daily_rotation'] or 'A'  # API gives null if not B-sides, for some reason
-    duration = song['time']
-    if duration is None:
-        duration = '?:??'
-    else:
-        duration = "{}:{:0>2}".format(duration // 60, duration % 60)
+    bot.say(_render(bot, song, trigger.sender))
 
-    difficulties = [
-        '{}: {}🟊, {} notes, {} kizuna'.format(
-            level.title(),
-            info['stars'],
-            info['notes'],
-            _bond_points(info['notes']),
-        ) for level, info in _get_song_level_info(song).items()
-    ]
 
-    bot.say("{}{} [{}] | {}, in {} {} — {}"
-        .format(
-            title,
-            ' ({})'.format(formatting.italic(romaji_title)) if romaji_title else '',
-            duration,
-            attribute,
-            main_unit,
-            'Hits' if rotation == 'A' else 'B-sides',
-            ' | '.join(difficulties),
-        )
+def _format_song_ranking(level, metric, descending, total, results):
+    """Render the output of :meth:`SongTable.query` as a line of IRC output."""
+    ranked = ', '.join(
+        '{} ({})'.format(
+            formatting.hex_color(song.name, ATTRIBUTE_COLORS[song.attribute.lower()]),
+            value)
+        for song, value in results)
+    return "Songs with the {} {} {} ({} of {}): {}".format(
+        'most' if descending else 'fewest',
+        level.title(),
+        metric,
+        len(results),
+        total,
+        ranked,
     )
+
+
+@module.commands('sifsongs')
+@module.example('.sifsongs top 5 smile master kizuna')
+@module.example('.sifsongs expert notes>=700')
+@_instrumented('sifsongs')
+def sif_songs(bot, trigger):
+    """Rank LLSIF songs by stars, notes, or kizuna at one difficulty.
+
+    Difficulty: easy/normal/hard/expert/master (default master). Rank by
+    stars, notes (default), or kizuna; "top"/"bottom" and a number pick the
+    order and how many songs to show. Compare with e.g. notes>=700 or
+    stars:11, and narrow down with the same keywords as .sifsong.
+    """
+    try:
+        (level, metric, descending, limit, conditions,
+         attribute, is_event, filters) = parse_songs_query(trigger.group(2))
+    except InvalidQueryError as err:
+        bot.reply("You have an error in your query: {}".format(err))
+        return
+
+    catalog = bot.memory.get('llsif_catalog')
+    if not catalog:
+        bot.reply("Ranking songs needs the local song catalog.")
+        return
+    if not catalog.is_complete('songs'):
+        try:
+            # pages every song into the catalog
+            _load_song_names(bot, trigger.sender)
+        except BusyError:
+            bot.reply(BUSY_MESSAGE)
+            return
+        except APIError:
+            bot.say("Sorry, something went wrong with the song API.")
+            LOGGER.exception("LLSIF API error!")
+            return
+
+    total, results = catalog.song_table().query(
+        level, metric, descending, limit, conditions,
+        attribute, is_event, filters.get('main_unit'))
+    if not results:
+        bot.reply("No song found!")
+        return
+
+    line = _format_song_ranking(level, metric, descending, total, results)
+    if not _use_color(bot, trigger.sender):
+        line = formatting.plain(line)
+    bot.say(line)
+
+
+def _fetch_all(bot, url, channel=None):
+    """Page through an API list endpoint, and get every result.
+
+    :raise APIError: if a page fails, or the pages don't add up to every result
+    """
+    results = []
+    page = 1
+    while page:
+        data = _api_call(bot, url, {'page_size': 100, 'page': page}, channel)
+        last = _is_last_page(data, url, page)
+        results.extend(data['results'])
+        page = None if last else page + 1
+    if len(results) < data['count']:
+        raise APIError("Got {} of {} results from {}.".format(
+            len(results), data['count'], url))
+    return results
+
+
+def _load_events(bot, channel=None):
+    """Get the :class:`EventIndex`, fetching every event the first time.
+
+    Events are kept in the local catalog if there is one, or else in memory
+    for as long as the plugin is loaded.
+    """
+    catalog = bot.memory.get('llsif_catalog')
+    if catalog and catalog.is_complete('events'):
+        return catalog.event_index()
+    index = bot.memory.get('llsif_events')
+    if index is not None:
+        return index
+
+    events = _fetch_all(bot, EVENT_API, channel)
+    if catalog:
+        catalog.store_events(events)
+        catalog.set_complete('events')
+        return catalog.event_index()
+    index = bot.memory['llsif_events'] = EventIndex(events)
+    return index
+
+
+EVENT_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+MAX_EVENT_LINES = 3
+
+
+def _format_event(event, card_ids=None):
+    """Render an event as a line of IRC output.
+
+    :param event: the event to render
+    :type event: :class:`Event`
+    :param list card_ids: IDs of the cards from the event, if known
+    :rtype: str
+    """
+    def dates(begin, end, tz):
+        times = [_parse_api_time(begin), _parse_api_time(end)]
+        if None in times:
+            return None
+        return ' – '.join(
+            datetime.datetime.fromtimestamp(when, tz).strftime('%Y-%m-%d')
+            for when in times)
+
+    parts = [formatting.bold(event.name)]
+    if event.japanese_name and event.japanese_name != event.name:
+        parts[0] += ' ({})'.format(event.japanese_name)
+    # each server's dates as its players saw them
+    for label, begin, end, tz in (
+            ('WW', event.english_beginning, event.english_end, UTC),
+            ('JP', event.beginning, event.end, JST)):
+        span = dates(begin, end, tz)
+        if span:
+            parts.append('{}: {}'.format(label, span))
+    if card_ids:
+        parts.append('Cards: {}'.format(', '.join('#{}'.format(i) for i in card_ids)))
+    return ' | '.join(parts)
+
+
+@module.commands('sifevent')
+@module.example('.sifevent')
+@module.example('.sifevent next')
+@module.example('.sifevent 2016-03-01')
+@module.example('.sifevent medley festival')
+@_instrumented('sifevent')
+def sif_event(bot, trigger):
+    """Look up LLSIF events: the current one, the next one, by date, or by name.
+
+    Dates are YYYY-MM-DD, and match events running on that day in either
+    JP or EN/WW. Names can be English, romaji, or Japanese, in part.
+    """
+    arg = (trigger.group(2) or '').strip()
+    try:
+        index = _load_events(bot, trigger.sender)
+    except BusyError:
+        bot.reply(BUSY_MESSAGE)
+        return
+    except APIError:
+        bot.say("Sorry, something went wrong with the event API.")
+        LOGGER.exception("LLSIF API error!")
+        return
+
+    now = time.time()
+    prefix = ''
+    if arg.lower() in ('', 'current', 'now'):
+        events = index.running(now, now)
+        if not events:
+            latest = index.timelines['ww'].before(now) or index.timelines['jp'].before(now)
+            if latest is None:
+                bot.reply("No event found!")
+                return
+            prefix = "No event is running. Latest: "
+            events = [latest]
+    elif arg.lower() == 'next':
+        events = []
+        for region, _, _ in EVENT_REGIONS:
+            event = index.timelines[region].after(now)
+            if event is not None and event not in events:
+                events.append(event)
+        if not events:
+            bot.reply("No upcoming events.")
+            return
+    elif EVENT_DATE_PATTERN.match(arg):
+        try:
+            day = datetime.datetime.strptime(arg, '%Y-%m-%d').replace(tzinfo=UTC)
+        except ValueError:
+            bot.reply("That's not a valid date.")
+            return
+        events = index.running(day.timestamp(), day.timestamp() + 24 * 60 * 60)
+    else:
+        event = index.find(arg)
+        events = [event] if event is not None else []
+
+    if not events:
+        bot.reply("No event found!")
+        return
+
+    catalog = bot.memory.get('llsif_catalog')
+    color = _use_color(bot, trigger.sender)
+    for event in events[:MAX_EVENT_LINES]:
+        card_ids = catalog.event_card_ids(event.japanese_name) if catalog else None
+        line = prefix + _format_event(event, card_ids)
+        bot.say(line if color else formatting.plain(line))
+
+
+def _load_idols(bot, channel=None):
+    """Get the :class:`IdolIndex`, fetching every idol the first time.
+
+    Idols are kept in the local catalog if there is one, or else in memory
+    for as long as the plugin is loaded.
+    """
+    catalog = bot.memory.get('llsif_catalog')
+    if catalog and catalog.is_complete('idols'):
+        return catalog.idol_index()
+    index = bot.memory.get('llsif_idols')
+    if index is not None:
+        return index
+
+    idols = _fetch_all(bot, IDOL_API, channel)
+    if catalog:
+        catalog.store_idols(idols)
+        catalog.set_complete('idols')
+        return catalog.idol_index()
+    index = bot.memory['llsif_idols'] = IdolIndex(idols)
+    return index
+
+
+def _format_idol_profile(idol, card_counts=None):
+    """Render an idol's profile as a line of IRC output.
+
+    :param idol: the idol to render
+    :type idol: :class:`IdolProfile`
+    :param dict card_counts: the idol's number of cards by rarity, if known
+    :rtype: str
+    """
+    name = format_idol(idol.name)
+    if idol.japanese_name:
+        name += ' ({})'.format(idol.japanese_name)
+    parts = [name]
+
+    school = ', '.join(filter(None, [idol.school, format_year(idol.year)]))
+    if school:
+        parts.append(school)
+    units = ', '.join(filter(None, [format_unit(idol.main_unit), format_unit(idol.sub_unit)]))
+    if units:
+        parts.append(units)
+    if idol.attribute:
+        parts.append(format_attribute(idol.attribute))
+    color = IDOL_COLORS.get(idol.name.lower())
+    if color:
+        parts.append('Color: {}'.format(formatting.hex_color('#' + color, color)))
+    height = '{} cm'.format(idol.height) if idol.height else None
+    for label, value in (('Birthday', idol.birthday), ('Age', idol.age),
+                         ('Height', height), ('Blood type', idol.blood),
+                         ('CV', idol.cv)):
+        if value:
+            parts.append('{}: {}'.format(label, value))
+    if card_counts:
+        parts.append('Cards: {}'.format(', '.join(
+            '{} {}'.format(card_counts[rarity], rarity)
+            for rarity in RARITIES.values() if rarity in card_counts)))
+    return ' | '.join(parts)
+
+
+@module.commands('sifidol')
+@module.example('.sifidol maki')
+@module.example('.sifidol watanabe you')
+@_instrumented('sifidol')
+def sif_idol(bot, trigger):
+    """Look up an LLSIF idol's profile, by name or nickname."""
+    arg = (trigger.group(2) or '').strip()
+    if not arg:
+        bot.reply("Which idol?")
+        return
+    try:
+        index = _load_idols(bot, trigger.sender)
+    except BusyError:
+        bot.reply(BUSY_MESSAGE)
+        return
+    except APIError:
+        bot.say("Sorry, something went wrong with the idol API.")
+        LOGGER.exception("LLSIF API error!")
+        return
+
+    idol = index.find(arg)
+    if idol is None:
+        bot.reply("No idol found!")
+        return
+
+    catalog = bot.memory.get('llsif_catalog')
+    counts = catalog.idol_card_counts(idol.name) if catalog else None
+    line = _format_idol_profile(idol, counts)
+    bot.say(line if _use_color(bot, trigger.sender) else formatting.plain(line))
+
+
+@module.commands('sifstats')
+@module.require_owner()
+def sif_stats(bot, trigger):
+    """Show LLSIF plugin latency, error, and cache statistics."""
+    stats = bot.memory.get('llsif_stats')
+    lines = stats.summary() if stats else []
+    if not lines:
+        bot.reply("No LLSIF stats recorded yet.")
+        return
+    for line in lines:
+        bot.say(line)
@@ -0,0 +1,114 @@
+# coding=utf-8
+"""Shared fakes for the LLSIF plugin's tests.
+
+Nothing touches the network: API responses come from :class:`FakeSession`,
+and time-dependent code can be driven by the ``clock`` fixture.
+"""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import json
+import os.path
+import sys
+import types as pytypes
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import llsif  # noqa: E402
+
+from sopel.config import types  # noqa: E402
+
+
+SONG_PAGE = '{"count": 1, "next": null, "results": [{"name": "Snow halation"}]}'
+
+
+def api_page(fixture, start=0, stop=None, count=None, next=None):
+    """Get the raw text of an API page holding some of a recorded fixture's results.
+
+    :param str fixture: file name in ``benchmarks/fixtures``
+    :param int count: the total the page claims (defaults to the whole fixture)
+    :param str next: the next page's URL, if any
+    """
+    with open(os.path.join(ROOT, 'benchmarks', 'fixtures', fixture), encoding='utf-8') as f:
+        results = json.load(f)['results']
+    return json.dumps({
+        'count': len(results) if count is None else count,
+        'next': next,
+        'previous': None,
+        'results': results[start:stop],
+    })
+
+
+class FakeClock(object):
+    """Stands in for the ``time`` module inside llsif; only moves when told to."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(llsif, 'time', clock)
+    return clock
+
+
+class FakeResponse(object):
+    def __init__(self, status_code=200, text='{}', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        import requests
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError('{} Error'.format(self.status_code))
+
+
+class FakeSession(object):
+    """Answers API requests from a list of responses (or exceptions), in order."""
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        self.requests.append((url, dict(params or {}), dict(headers or {})))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def close(self):
+        pass
+
+
+def default_config():
+    """Get the plugin's config section, with every setting at its default."""
+    config = pytypes.SimpleNamespace()
+    for name in dir(llsif.LLSIFSection):
+        attr = getattr(llsif.LLSIFSection, name)
+        if isinstance(attr, types.BaseValidated):
+            setattr(config, name, attr.default)
+    return config
+
+
+def make_bot(session=None, **memory):
+    bot = pytypes.SimpleNamespace(
+        config=pytypes.SimpleNamespace(llsif=default_config()), memory={})
+    bot.memory['llsif_session'] = session or FakeSession()
+    bot.memory['llsif_stats'] = llsif.Stats()
+    bot.memory.update(memory)
+    return bot
@@ -0,0 +1,80 @@
+# coding=utf-8
+"""Tests for the API circuit breaker and adaptive timeouts."""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import pytest
+import requests
+
+import llsif
+
+from conftest import FakeResponse, FakeSession, make_bot
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = llsif.CircuitBreaker(threshold=3, cooldown=30)
+    for _ in range(2):
+        breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == breaker.OPEN
+    assert breaker.is_open()
+    assert not breaker.allow()
+
+
+def test_breaker_half_open_probe_failure_reopens(clock):
+    changes = []
+    breaker = llsif.CircuitBreaker(threshold=1, cooldown=30, on_change=changes.append)
+    breaker.failure()
+    clock.advance(30)
+    assert not breaker.is_open()
+
+    # exactly one probe gets through
+    assert breaker.allow()
+    assert breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.failure()
+    assert breaker.state == breaker.OPEN
+    assert breaker.is_open()
+    assert changes == [breaker.OPEN, breaker.HALF_OPEN, breaker.OPEN]
+
+
+def test_breaker_half_open_probe_success_closes(clock):
+    breaker = llsif.CircuitBreaker(threshold=1, cooldown=30)
+    breaker.failure()
+    clock.advance(31)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == breaker.CLOSED
+    assert breaker.allow()
+
+
+def test_api_failures_open_breaker(clock):
+    breaker = llsif.CircuitBreaker(threshold=2, cooldown=30)
+    session = FakeSession(
+        requests.exceptions.ConnectionError(), FakeResponse(500))
+    bot = make_bot(session, llsif_breaker=breaker)
+
+    for _ in range(2):
+        with pytest.raises(llsif.APIError):
+            llsif._api_fetch(bot, llsif.SONG_API, {}, '#a', deadline=clock.now + 5)
+    assert breaker.state == breaker.OPEN
+
+
+def test_background_failures_leave_breaker_closed(clock):
+    breaker = llsif.CircuitBreaker(threshold=1, cooldown=30)
+    session = FakeSession(requests.exceptions.ReadTimeout())
+    bot = make_bot(session, llsif_breaker=breaker)
+
+    with pytest.raises(llsif.APIError):
+        llsif._api_fetch(bot, llsif.SONG_API, {'page_size': 100})
+    assert breaker.state == breaker.CLOSED
+
+
+def test_adaptive_timeout_classes_are_separate():
+    timeouts = llsif.AdaptiveTimeout(10.0, 4.0, floor=1.0, multiplier=3.0)
+    for _ in range(timeouts.MIN_SAMPLES):
+        timeouts.record('single', 0.01)
+    assert timeouts.current('single') == (1.0, 1.0)
+    # quick single lookups don't shrink the timeout for big pages
+    assert timeouts.current('page') == (10.0, 4.0)
@@ -0,0 +1,52 @@
+# coding=utf-8
+"""Tests for sending announcements to many channels."""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import types as pytypes
+
+import pytest
+
+import llsif
+
+from sopel.irc.isupport import ISupport, parse_parameter
+
+
+@pytest.mark.parametrize('tokens, targets', [
+    # nothing advertised, or no PRIVMSG limit given: one at a time
+    ([], 1),
+    (['TARGMAX=JOIN:'], 1),
+    (['TARGMAX=PRIVMSG:4,NOTICE:4'], 4),
+    # advertised without a limit, or with a huge one: our own cap
+    (['TARGMAX=PRIVMSG:'], llsif.BROADCAST_MAX_TARGETS),
+    (['TARGMAX=PRIVMSG:1000'], llsif.BROADCAST_MAX_TARGETS),
+])
+def test_privmsg_targets(tokens, targets):
+    isupport = ISupport(**dict(parse_parameter(token) for token in tokens))
+    bot = pytypes.SimpleNamespace(isupport=isupport)
+    assert llsif._privmsg_targets(bot) == targets
+
+
+def test_batch_targets_respects_target_limit():
+    channels = ['#c{}'.format(i) for i in range(10)]
+    batches = list(llsif._batch_targets(channels, 'hello', 4))
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    # every channel once, in order
+    assert sum(batches, []) == channels
+
+
+def test_batch_targets_fit_in_one_line():
+    channels = ['#' + 'x' * 49 + str(i) for i in range(40)]
+    text = llsif.RC_5X_MESSAGE
+    batches = list(llsif._batch_targets(channels, text, 100))
+    assert len(batches) > 1
+    assert sum(batches, []) == channels
+    for batch in batches:
+        assert len(','.join(batch).encode('utf-8')) + len(text.encode('utf-8')) \
+            <= llsif.BROADCAST_LINE_BYTES
+
+
+def test_batch_targets_never_drops_a_long_channel():
+    # too long to share a line with anything, but still sent on its own
+    channel = '#' + 'x' * llsif.BROADCAST_LINE_BYTES
+    assert list(llsif._batch_targets(['#a', channel, '#b'], 'hi', 20)) == [
+        ['#a'], [channel], ['#b']]
@@ -0,0 +1,79 @@
+# coding=utf-8
+"""Tests for the local card/song catalog."""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import json
+import types as pytypes
+
+import llsif
+
+from conftest import FakeResponse, FakeSession, api_page, make_bot
+
+
+def records(fixture, record):
+    return llsif._decode_page(api_page(fixture), record)['results']
+
+
+def test_derived_indexes_only_rebuild_for_their_own_kind():
+    catalog = llsif.Catalog(':memory:')
+    cards = records('cards.json', llsif.Card)
+    songs = records('songs.json', llsif.Song)
+    catalog.store_cards(cards[:2])
+    catalog.store_songs(songs)
+
+    song_index = catalog.song_index()
+    song_table = catalog.song_table()
+    card_index = catalog.card_word_index()
+
+    # card writes, empty writes, and rewrites of identical rows leave the
+    # song structures alone
+    catalog.store_cards(cards[2:])
+    catalog.store_cards([])
+    catalog.store_songs(songs)
+    assert catalog.song_index() is song_index
+    assert catalog.song_table() is song_table
+    assert catalog.card_word_index() is not card_index
+
+    changed = json.loads(api_page('songs.json'))['results'][0]
+    changed['translated_name'] = 'Snow Halation (new translation)'
+    catalog.store_songs([llsif.Song.from_json(changed)])
+    assert catalog.song_index() is not song_index
+    assert catalog.song_table() is not song_table
+
+
+def test_song_ranking_skips_the_api_once_songs_are_complete(monkeypatch):
+    catalog = llsif.Catalog(':memory:')
+    catalog.store_songs(records('songs.json', llsif.Song))
+    catalog.set_complete('songs')
+    # no responses queued: any API call would fail the test
+    bot = make_bot(llsif_catalog=catalog)
+    replies = []
+    bot.say = bot.reply = replies.append
+    monkeypatch.setattr(catalog, 'song_names', None)
+
+    trigger = pytypes.SimpleNamespace(group=lambda n: 'top 3', sender='#llsif')
+    llsif.sif_songs(bot, trigger)
+    assert not bot.memory['llsif_session'].requests
+    assert len(replies) == 1 and 'No song' not in replies[0]
+
+
+def test_complete_catalog_answers_card_batches_alone():
+    cards = records('cards.json', llsif.Card)
+    catalog = llsif.Catalog(':memory:')
+    catalog.store_cards(cards)
+    bot = make_bot(llsif_catalog=catalog)
+    known = cards[0].id
+    unknown = max(card.id for card in cards) + 1
+
+    # a partial catalog asks the API for what it doesn't have...
+    bot.memory['llsif_session'] = FakeSession(FakeResponse(text=api_page('cards.json', 0, 0)))
+    assert list(llsif._get_cards(bot, [known, unknown])) == [known]
+    assert bot.memory['llsif_session'].requests[0][1]['ids'] == str(unknown)
+    # ...and doesn't count an empty answer as a change
+    assert catalog.versions['cards'] == len(cards)
+
+    # a complete one knows there's nothing more to find
+    catalog.set_complete('cards')
+    bot.memory['llsif_session'] = FakeSession()
+    assert list(llsif._get_cards(bot, [known, unknown])) == [known]
+    assert not bot.memory['llsif_session'].requests
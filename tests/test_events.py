@@ -0,0 +1,38 @@
+# coding=utf-8
+"""Tests for the event index."""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import pytest
+
+import llsif
+
+from conftest import FakeResponse, FakeSession, api_page, make_bot
+
+
+def test_interval_index_overlaps_and_neighbours():
+    index = llsif.IntervalIndex([
+        (10, 20, 'b'),
+        (0, 100, 'long'),
+        (30, 40, 'c'),
+        (15, 35, 'd'),
+    ])
+    assert index.overlapping(18, 19) == ['long', 'b', 'd']
+    assert index.overlapping(20, 30) == ['long', 'd']
+    # intervals are half-open: one ending at 40 doesn't cover 40
+    assert index.overlapping(40, 41) == ['long']
+    assert index.overlapping(100, 200) == []
+    assert index.before(15) == 'b'
+    assert index.before(0) is None
+    assert index.after(15) == 'c'
+    assert index.after(30) is None
+
+
+def test_events_not_stored_from_a_missing_page():
+    catalog = llsif.Catalog(':memory:')
+    bot = make_bot(FakeSession(
+        FakeResponse(text=api_page('events.json', 0, 1, next=llsif.EVENT_API + '?page=2')),
+        FakeResponse(404),
+    ), llsif_catalog=catalog)
+    with pytest.raises(llsif.APIError):
+        llsif._load_events(bot)
+    assert not catalog.is_complete('events')
@@ -0,0 +1,113 @@
+# coding=utf-8
+"""Tests for parsing card and song search queries."""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import pytest
+
+import llsif
+
+from conftest import api_page, make_bot
+
+
+def idol_filter(query):
+    return llsif.parse_card_query(query)[5].get('name')
+
+
+@pytest.mark.parametrize('query, idol', [
+    # parts of these full names are also nicknames for someone else
+    ('yuuki anju', 'Yuuki Anju'),
+    ('anju yuuki', 'Yuuki Anju'),
+    ('Yuuki Anju ur', 'Yuuki Anju'),
+    ('yuuki', 'Yuki Setsuna'),
+    ('sonoda umi', 'Sonoda Umi'),
+    ('umi', 'Sonoda Umi'),
+    ('watanabe you', 'Watanabe You'),
+    ('you watanabe', 'Watanabe You'),
+    ('maki', 'Nishikino Maki'),
+])
+def test_idol_names(query, idol):
+    assert idol_filter(query) == idol
+
+
+@pytest.mark.parametrize('query', ['i love you', 'ai no hime', 'ruby', 'rin', '"maki"'])
+def test_everyday_words_stay_text(query):
+    text = llsif.parse_card_query(query)[0]
+    assert idol_filter(query) is None
+    assert text == query.strip('"')
+
+
+def test_quoted_part_breaks_a_full_name():
+    text, _, _, _, _, filters = llsif.parse_card_query('"yuuki" anju')
+    assert text == 'yuuki'
+    assert filters['name'] == 'Yuuki Anju'
+
+
+def test_multiple_idols_refused():
+    with pytest.raises(llsif.InvalidQueryError):
+        llsif.parse_card_query('maki nico')
+
+
+def test_tokenizer_classifies_each_token():
+    tokens = list(llsif._tokenize_query('"snow halation" Non-Promo !event id:12 year:first'))
+    assert tokens == [
+        ('text', 'snow halation', None, '"snow halation"'),
+        ('keyword', 'promo', False, 'Non-Promo'),
+        ('keyword', 'event', False, '!event'),
+        ('filter', 'id__gte', 12, 'id:12'),
+        ('filter', 'id__lte', 12, 'id:12'),
+        ('filter', 'year', 'First', 'year:first'),
+    ]
+
+
+@pytest.mark.parametrize('query', ['year>first', 'year:fifth', 'unit:nobody', 'id:abc'])
+def test_tokenizer_rejects_bad_filters(query):
+    with pytest.raises(llsif.InvalidQueryError):
+        list(llsif._tokenize_query(query))
+
+
+@pytest.mark.parametrize('query', ['non-promo', 'nonpromo', '!promo'])
+def test_non_promo(query):
+    text, _, _, promo, _, _ = llsif.parse_card_query(query + ' ur')
+    assert text == ''
+    assert promo is False
+
+
+@pytest.mark.parametrize('has_catalog', [False, True])
+def test_id_range_needs_a_complete_catalog(has_catalog):
+    # a catalog that is still syncing can't know which cards it's missing
+    catalog = llsif.Catalog(':memory:') if has_catalog else None
+    bot = make_bot(llsif_catalog=catalog)
+    query = llsif.parse_card_query('id>100')
+    with pytest.raises(llsif.InvalidQueryError):
+        llsif._get_card_page(bot, query, 1)
+    # and nothing is asked of the API, which can't filter by ID
+    assert not bot.memory['llsif_session'].requests
+
+
+def test_id_range_from_a_complete_catalog():
+    cards = llsif._decode_page(api_page('cards.json'), llsif.Card)['results']
+    catalog = llsif.Catalog(':memory:')
+    catalog.store_cards(cards)
+    catalog.set_complete('cards')
+    bot = make_bot(llsif_catalog=catalog)
+    lowest = min(card.id for card in cards)
+    total, found = llsif._get_card_page(
+        bot, llsif.parse_card_query('id>{}'.format(lowest)), 1)
+    assert total == len(cards) - 1
+    assert all(card.id > lowest for card in found)
+
+
+@pytest.mark.parametrize('arg, ids', [
+    ('1201', [1201]),
+    ('1201 1205-1208', [1201, 1205, 1206, 1207, 1208]),
+    # in the order given, without repeats
+    ('30 10-12 11 30', [30, 10, 11, 12]),
+])
+def test_parse_card_ids(arg, ids):
+    assert llsif._parse_card_ids(arg, 10) == ids
+
+
+@pytest.mark.parametrize('arg', ['12-10', '1-11', '1-5 7-12', '1-1000000000'])
+def test_parse_card_ids_refuses(arg):
+    with pytest.raises(llsif.InvalidQueryError):
+        llsif._parse_card_ids(arg, 10)
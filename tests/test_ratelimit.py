@@ -0,0 +1,105 @@
+# coding=utf-8
+"""Tests for the API rate limiter."""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import collections
+import threading
+import time
+
+import pytest
+
+import llsif
+
+from conftest import FakeSession, make_bot
+
+
+def test_rate_limiter_burst_then_refuses_past_deadline(clock):
+    limiter = llsif.RateLimiter(rate=1.0, burst=2)
+    limiter.acquire('#a', llsif.PRIORITY_LOOKUP)
+    limiter.acquire('#a', llsif.PRIORITY_LOOKUP)
+    # the next token is a whole second away
+    with pytest.raises(llsif.RateLimitedError):
+        limiter.acquire('#a', llsif.PRIORITY_LOOKUP, deadline=clock.now + 0.5)
+
+    clock.advance(1.0)
+    limiter.acquire('#a', llsif.PRIORITY_LOOKUP, deadline=clock.now + 0.5)
+
+
+def test_rate_limiter_deadline_counts_queued_requests(clock):
+    limiter = llsif.RateLimiter(rate=1.0, burst=1)
+    limiter.acquire('#a', llsif.PRIORITY_SEARCH)
+    # two requests already waiting at this priority would go first
+    limiter._queues[llsif.PRIORITY_SEARCH]['#b'] = collections.deque(
+        [object(), object()])
+    with pytest.raises(llsif.RateLimitedError):
+        limiter.acquire('#c', llsif.PRIORITY_SEARCH, deadline=clock.now + 2.5)
+
+
+def queued(limiter):
+    return sum(len(tickets) for queue in limiter._queues for tickets in queue.values())
+
+
+def start_queued(limiter, target, *args):
+    """Start a thread calling ``target``, and wait until it's in the queue."""
+    before = queued(limiter)
+    thread = threading.Thread(target=target, args=args)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while queued(limiter) == before and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return thread
+
+
+def test_rate_limiter_takes_turns_between_channels():
+    # slow enough that every request is queued before the first token
+    limiter = llsif.RateLimiter(rate=5.0, burst=1)
+    limiter.acquire(None, llsif.PRIORITY_SEARCH)
+    served = []
+
+    def request(channel):
+        limiter.acquire(channel, llsif.PRIORITY_SEARCH)
+        served.append(channel)
+
+    threads = [
+        start_queued(limiter, request, channel)
+        for channel in ['#busy', '#busy', '#busy', '#quiet']
+    ]
+    for thread in threads:
+        thread.join(5)
+
+    # the quiet channel doesn't wait behind all of the busy one's requests
+    assert served == ['#busy', '#quiet', '#busy', '#busy']
+
+
+def test_rate_limiter_serves_higher_priority_first():
+    limiter = llsif.RateLimiter(rate=5.0, burst=1)
+    limiter.acquire(None, llsif.PRIORITY_LOOKUP)
+    served = []
+
+    def request(priority):
+        limiter.acquire('#a', priority)
+        served.append(priority)
+
+    threads = [
+        start_queued(limiter, request, priority)
+        for priority in [llsif.PRIORITY_BACKGROUND, llsif.PRIORITY_SEARCH,
+                         llsif.PRIORITY_LOOKUP]
+    ]
+    for thread in threads:
+        thread.join(5)
+
+    assert served == [llsif.PRIORITY_LOOKUP, llsif.PRIORITY_SEARCH,
+                      llsif.PRIORITY_BACKGROUND]
+
+
+def test_open_breaker_refuses_without_using_rate_limit_tokens(clock):
+    limiter = llsif.RateLimiter(rate=1.0, burst=1)
+    breaker = llsif.CircuitBreaker(threshold=1, cooldown=30)
+    breaker.failure()
+    session = FakeSession()
+    bot = make_bot(session, llsif_limiter=limiter, llsif_breaker=breaker)
+
+    with pytest.raises(llsif.APIError):
+        llsif._api_fetch(bot, llsif.SONG_API, {}, '#a', deadline=clock.now + 5)
+    assert not session.requests
+    assert limiter._tokens == 1
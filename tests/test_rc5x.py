@@ -0,0 +1,106 @@
+# coding=utf-8
+"""Tests for the Rhythmic Carnival 5x EXP hour timer."""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import datetime
+import types as pytypes
+
+import pytest
+
+import llsif
+
+
+UTC = llsif.UTC
+
+
+def at(day, hour, minute=0, second=0):
+    # 2026-10-17 is a Saturday
+    return datetime.datetime(2026, 10, day, hour, minute, second, tzinfo=UTC)
+
+
+@pytest.mark.parametrize('now, expected', [
+    (at(16, 12), at(17, 3)),       # Friday: the first weekend hour
+    (at(17, 3), at(17, 8)),        # exactly at a start: the next one
+    (at(17, 2, 59, 59), at(17, 3)),
+    (at(18, 12, 0, 1), at(24, 3)),  # after Sunday's last: next Saturday
+    # Saturday 10:00 in Tokyo is still 01:00 UTC
+    (datetime.datetime(2026, 10, 17, 10, tzinfo=datetime.timezone(
+        datetime.timedelta(hours=9))), at(17, 3)),
+])
+def test_next_rc_5x(now, expected):
+    assert llsif._next_rc_5x(now) == expected
+
+
+class TimerRun(object):
+    """Drives a WeeklyTimer's thread loop on a fake wall clock.
+
+    Each wait moves the clock by how long the timer asked to sleep, plus any
+    jump scheduled for that wait (numbered from 1); the run is cancelled
+    after ``fires`` announcements.
+    """
+    def __init__(self, monkeypatch, start, fires, jumps=None):
+        self.now = start
+        self.waits = []
+        self.fired = []
+        self.jumps = jumps or {}
+        self.fires = fires
+
+        run = self
+
+        class FakeDateTime(datetime.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return run.now
+
+        monkeypatch.setattr(llsif, 'datetime', pytypes.SimpleNamespace(
+            datetime=FakeDateTime, timedelta=datetime.timedelta))
+        self.timer = llsif.WeeklyTimer(self.fire)
+        self.timer._wakeup = self
+
+    def fire(self, fire_at):
+        self.fired.append(fire_at)
+        if len(self.fired) >= self.fires:
+            self.timer.cancel()
+
+    def set(self):
+        pass
+
+    def wait(self, seconds):
+        assert len(self.waits) < 1000, "the timer never fired"
+        self.waits.append(seconds)
+        self.now += datetime.timedelta(seconds=seconds)
+        self.now += self.jumps.get(len(self.waits), datetime.timedelta())
+
+    def run(self):
+        self.timer._run()
+        return self
+
+
+def test_timer_sleeps_long_until_close_to_a_start(monkeypatch):
+    run = TimerRun(monkeypatch, at(14, 0), fires=1).run()
+    # Wednesday midnight to Saturday 03:00 is 75 hours: a few long sleeps up
+    # to the final stretch, then short rechecks until the start time
+    assert run.fired == [at(17, 3)]
+    assert max(run.waits) == llsif.MAX_TIMER_SLEEP
+    assert len(run.waits) <= (
+        75 * 60 * 60 // llsif.MAX_TIMER_SLEEP + 1
+        + llsif.TIMER_FINAL_STRETCH // llsif.TIMER_RECHECK)
+
+
+def test_timer_fires_each_start_once(monkeypatch):
+    run = TimerRun(monkeypatch, at(17, 2), fires=6).run()
+    assert run.fired == [at(17, 3), at(17, 8), at(17, 12), at(18, 3), at(18, 8), at(18, 12)]
+
+
+def test_timer_skips_starts_it_slept_through(monkeypatch):
+    # right before Saturday 03:00, the machine is suspended for a day
+    run = TimerRun(monkeypatch, at(17, 2, 59), fires=1, jumps={
+        1: datetime.timedelta(days=1)}).run()
+    # Saturday's hours are all skipped, not announced a day late in a burst
+    assert run.fired == [at(18, 8)]
+
+
+def test_timer_announces_a_little_late(monkeypatch):
+    run = TimerRun(monkeypatch, at(17, 2, 59), fires=1, jumps={
+        1: datetime.timedelta(seconds=llsif.RC_5X_GRACE - 60)}).run()
+    assert run.fired == [at(17, 3)]
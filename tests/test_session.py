@@ -0,0 +1,30 @@
+# coding=utf-8
+"""Tests for the pooled HTTP session's retry policy."""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import pytest
+from urllib3.exceptions import MaxRetryError, ProtocolError, ReadTimeoutError
+
+import llsif
+
+from conftest import default_config
+
+
+@pytest.fixture
+def retry():
+    session = llsif._make_session(default_config())
+    return session.adapters['https://'].max_retries
+
+
+def test_dropped_connection_is_retried(retry):
+    error = ProtocolError('Connection aborted.', ConnectionResetError())
+    for _ in range(default_config().api_retries):
+        retry = retry.increment('GET', '/api/cards/', error=error)
+    with pytest.raises(MaxRetryError):
+        retry.increment('GET', '/api/cards/', error=error)
+
+
+def test_read_timeout_is_not_retried(retry):
+    error = ReadTimeoutError(None, '/api/cards/', 'Read timed out.')
+    with pytest.raises(ReadTimeoutError):
+        retry.increment('GET', '/api/cards/', error=error)
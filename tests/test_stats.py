@@ -0,0 +1,31 @@
+# coding=utf-8
+"""Tests for the plugin's stats and the Prometheus stats file."""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import logging
+
+import llsif
+
+
+def test_stats_file_is_replaced_whole(tmp_path):
+    stats = llsif.Stats()
+    stats.count('lookups', 'card', 'api')
+    filename = str(tmp_path / 'llsif.prom')
+    llsif.StatsFile(stats, filename).write()
+    with open(filename) as f:
+        assert 'llsif_lookups_total{kind="card",source="api"} 1' in f.read()
+    assert not (tmp_path / 'llsif.prom.tmp').exists()
+
+
+def test_stats_file_errors_are_logged_once(tmp_path, caplog):
+    filename = str(tmp_path / 'missing' / 'llsif.prom')
+    writer = llsif.StatsFile(llsif.Stats(), filename)
+    with caplog.at_level(logging.INFO):
+        writer.write()
+        writer.write()
+        assert len(caplog.records) == 1
+
+        (tmp_path / 'missing').mkdir()
+        writer.write()
+        writer.write()
+        assert len(caplog.records) == 2
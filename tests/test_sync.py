@@ -0,0 +1,104 @@
+# coding=utf-8
+"""Tests for filling the local catalog from the API."""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import pytest
+import requests
+
+import llsif
+
+from conftest import FakeResponse, FakeSession, api_page, make_bot
+
+
+NEXT = 'https://schoolido.lu/api/cards/?page=2'
+
+
+def make_sync(*responses):
+    bot = make_bot(FakeSession(*responses))
+    bot.config.llsif.sync_delay = 0
+    catalog = llsif.Catalog(':memory:')
+    return llsif.CatalogSync(bot, catalog), catalog
+
+
+def test_missing_page_is_an_error_not_the_end():
+    sync, catalog = make_sync(
+        FakeResponse(text=api_page('cards.json', 0, 3, next=NEXT)),
+        FakeResponse(404),
+    )
+    with pytest.raises(llsif.APIError):
+        sync.sync_cards()
+    assert not catalog.is_complete('cards')
+    # the next try picks up where this one stopped
+    assert catalog.get_meta('cards_sync_page') == '2'
+
+
+def test_cards_complete_after_real_last_page():
+    sync, catalog = make_sync(
+        FakeResponse(text=api_page('cards.json', 0, 3, next=NEXT)),
+        FakeResponse(text=api_page('cards.json', 3)),
+    )
+    sync.sync_cards()
+    assert catalog.is_complete('cards')
+    assert catalog.count('cards') == 6
+
+
+def test_last_page_short_of_count_is_not_complete():
+    sync, catalog = make_sync(FakeResponse(text=api_page('cards.json', 0, 3, count=10)))
+    with pytest.raises(llsif.APIError):
+        sync.sync_cards()
+    assert not catalog.is_complete('cards')
+
+
+def test_songs_complete_only_with_every_song():
+    sync, catalog = make_sync(
+        FakeResponse(text=api_page('songs.json', 0, 2, count=4)),
+        FakeResponse(text=api_page('songs.json')),
+    )
+    with pytest.raises(llsif.APIError):
+        sync.sync_songs()
+    assert not catalog.is_complete('songs')
+
+    sync.sync_songs()
+    assert catalog.is_complete('songs')
+
+
+class StopAfter(object):
+    """Stands in for the sync's cancel event, recording how long it waits."""
+    def __init__(self, waits):
+        self.waits = []
+        self._left = waits
+
+    def is_set(self):
+        return False
+
+    def wait(self, seconds):
+        self.waits.append(seconds)
+        self._left -= 1
+        return self._left <= 0
+
+
+def test_failed_warm_up_retries_with_backoff():
+    sync, catalog = make_sync(*[requests.exceptions.ConnectionError()] * 3)
+    sync.config.sync_delay = 2.0
+    sync._cancelled = StopAfter(3)
+    sync._run()
+    # not the full sync_interval (a day) before trying again
+    assert sync._cancelled.waits == [2.0, 4.0, 8.0]
+
+
+def test_song_names_need_every_page():
+    catalog = llsif.Catalog(':memory:')
+    bot = make_bot(FakeSession(
+        FakeResponse(text=api_page('songs.json', 0, 2, next=NEXT)),
+        FakeResponse(404),
+    ), llsif_catalog=catalog)
+    with pytest.raises(llsif.APIError):
+        llsif._load_song_names(bot)
+    assert not catalog.is_complete('songs')
+
+    bot.memory['llsif_session'] = FakeSession(
+        FakeResponse(text=api_page('songs.json', 0, 2, next=NEXT)),
+        FakeResponse(text=api_page('songs.json', 2)),
+    )
+    assert len(llsif._load_song_names(bot)) == 4
+    assert catalog.is_complete('songs')
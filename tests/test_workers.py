@@ -0,0 +1,63 @@
+# coding=utf-8
+"""Tests for API request coalescing and the worker pool."""
+from __future__ import unicode_literals, absolute_import, print_function, division
+
+import threading
+import time
+
+import pytest
+
+import llsif
+
+
+def test_single_flight_coalesces_until_done():
+    flights = llsif.SingleFlight()
+    pool = llsif.WorkerPool(threads=1, queue=1)
+    release = threading.Event()
+    started = []
+
+    def start():
+        started.append(1)
+        return pool.submit(release.wait, 5)
+
+    try:
+        first = flights.do('key', start)
+        second = flights.do('key', start)
+        assert first is second
+        assert len(started) == 1
+
+        release.set()
+        first.result(5)
+        # a finished call is forgotten, so the next one starts afresh
+        third = flights.do('key', start)
+        assert third is not first
+        assert len(started) == 2
+        third.result(5)
+    finally:
+        pool.shutdown()
+
+
+def test_worker_pool_refuses_when_full():
+    pool = llsif.WorkerPool(threads=1, queue=1)
+    release = threading.Event()
+    try:
+        running = pool.submit(release.wait, 5)
+        queued = pool.submit(release.wait, 5)
+        with pytest.raises(llsif.BusyError):
+            pool.submit(release.wait, 5)
+
+        release.set()
+        running.result(5)
+        queued.result(5)
+        # the slot release happens in a done callback; give it a moment
+        deadline = time.monotonic() + 1
+        while True:
+            try:
+                pool.submit(lambda: None).result(5)
+                break
+            except llsif.BusyError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.001)
+    finally:
+        pool.shutdown()